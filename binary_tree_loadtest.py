@@ -0,0 +1,154 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# ---------------- Нагрузочный тест для binary_tree_server.py ----------------
+async def _open(host: str, port: int, unix_path: Optional[str]) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    # Целый уровень в ответе может весить мегабайты — лимит строки побольше.
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path, limit=1 << 26)
+    return await asyncio.open_connection(host, port, limit=1 << 26)
+
+
+def make_request(rng: random.Random, roots: List[int], heights: List[int]) -> Dict[str, Any]:
+    """
+    Случайный запрос в духе коротких процессов, которые раз за разом
+    просят одни и те же деревья: немного корней и высот, три вида операций.
+    """
+    root = rng.choice(roots)
+    height = rng.choice(heights)
+    kind = rng.random()
+    if kind < 0.2:
+        return {"op": "build", "root": root, "height": height}
+    level = rng.randrange(height)
+    if kind < 0.6:
+        start = rng.randrange(1 << level)
+        return {"op": "level", "root": root, "height": height, "level": level,
+                "start": start, "stop": start + 16}
+    return {"op": "node", "root": root, "level": level, "index": rng.randrange(1 << level)}
+
+
+async def _client(
+    host: str,
+    port: int,
+    unix_path: Optional[str],
+    requests: int,
+    seed: int,
+    roots: List[int],
+    heights: List[int],
+    latencies: List[float],
+) -> int:
+    """Один клиент: requests запросов подряд по одному соединению. Возвращает число ошибок."""
+    rng = random.Random(seed)
+    reader, writer = await _open(host, port, unix_path)
+    errors = 0
+    try:
+        for _ in range(requests):
+            payload = json.dumps(make_request(rng, roots, heights)).encode() + b"\n"
+            start = time.perf_counter()
+            writer.write(payload)
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if not response.get("ok"):
+                errors += 1
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return errors
+
+
+async def run_load(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix_path: Optional[str] = None,
+    clients: int = 16,
+    requests: int = 200,
+    roots: Optional[List[int]] = None,
+    heights: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    clients одновременных клиентов по requests запросов.
+    Возвращаю p50/p99 задержки (мс), пропускную способность и число ошибок.
+    """
+    roots = roots or [14, 3, -7, 100]
+    heights = heights or [8, 12, 16]
+    latencies: List[float] = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(
+        _client(host, port, unix_path, requests, seed, roots, heights, latencies)
+        for seed in range(clients)
+    ))
+    elapsed = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": cuts[49] * 1e3,
+        "p99_ms": cuts[98] * 1e3,
+        "max_ms": max(latencies) * 1e3,
+    }
+
+
+async def _wait_for_server(host: str, port: int, unix_path: Optional[str], timeout: float = 10.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await _open(host, port, unix_path)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера деревьев")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="путь Unix-сокета (вместо TCP)")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="запросов на клиента")
+    parser.add_argument("--spawn", action="store_true",
+                        help="сначала запустить binary_tree_server.py отдельным процессом")
+    args = parser.parse_args(argv)
+
+    server: Optional[subprocess.Popen] = None
+    if args.spawn:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "binary_tree_server.py")
+        cmd = [sys.executable, script, "--host", args.host, "--port", str(args.port)]
+        if args.unix:
+            cmd += ["--unix", args.unix]
+        server = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(_wait_for_server(args.host, args.port, args.unix))
+        report = asyncio.run(run_load(args.host, args.port, args.unix, args.clients, args.requests))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"Клиентов: {report['clients']}, запросов: {report['requests']}, ошибок: {report['errors']}")
+    print(f"Пропускная способность: {report['throughput_rps']:.0f} запросов/с")
+    print(f"Задержка: p50 {report['p50_ms']:.2f} мс, p99 {report['p99_ms']:.2f} мс, "
+          f"max {report['max_ms']:.2f} мс")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
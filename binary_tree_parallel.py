@@ -0,0 +1,138 @@
+from __future__ import annotations
+import os
+import timeit
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from binary_tree_step3 import (
+    FlatTree,
+    build_tree_iterative,
+    iter_levels,
+    left_child_variant_14,
+    right_child_variant_14,
+)
+
+
+# ---------------- Параллельное построение в общей памяти ----------------
+# Раскладка та же, что у FlatTree: уровень L занимает узлы [2**L - 1, 2**(L+1) - 1).
+# Поддерево с номером j, растущее с уровня split, на уровне L занимает
+# непрерывный кусок ширины 2**(L - split), начиная с j * 2**(L - split).
+# Поэтому каждый процесс пишет в свои куски и никому не мешает.
+_TYPECODE = "q"
+_ITEMSIZE = array(_TYPECODE).itemsize
+
+_SubtreeTask = Tuple[str, int, int, int, int, Callable[[int], int], Callable[[int], int]]
+
+
+def _build_subtree_into_shared(task: _SubtreeTask) -> None:
+    """
+    Работа одного процесса: строю поддерево от узла (split, j) до низа
+    и пишу каждый его уровень сразу в общую память. Назад ничего не возвращаю,
+    так что пиклить огромные списки не приходится.
+    """
+    shm_name, height, split, j, value, left_fn, right_fn = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = memoryview(shm.buf).cast(_TYPECODE)
+    try:
+        current: List[int] = [value]
+        for level in range(split + 1, height):
+            nxt: List[int] = []
+            for v in current:
+                nxt.append(left_fn(v))
+                nxt.append(right_fn(v))
+            width = 1 << (level - split)
+            start = (1 << level) - 1 + j * width
+            view[start:start + width] = array(_TYPECODE, nxt)
+            current = nxt
+    finally:
+        view.release()
+        shm.close()
+
+
+def _choose_split_level(height: int, workers: int) -> int:
+    """
+    Уровень, с которого раздаю поддеревья: беру примерно 4 задачи на процесс,
+    чтобы процессы не простаивали, если кто-то закончит раньше.
+    """
+    split = 0
+    while (1 << split) < 4 * workers and split < height - 1:
+        split += 1
+    return split
+
+
+def build_tree_parallel(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int] = left_child_variant_14,
+    right_fn: Callable[[int], int] = right_child_variant_14,
+    workers: Optional[int] = None,
+) -> FlatTree:
+    """
+    Параллельное построение на нескольких процессах.
+
+    Верхние уровни (до split) строю сам, потом 2**split независимых поддеревьев
+    раздаю в пул процессов. Каждый процесс пишет свои куски уровней прямо
+    в multiprocessing.shared_memory, а в конце я один раз копирую буфер в FlatTree.
+
+    left_fn и right_fn должны пиклиться (обычные функции модуля подходят,
+    лямбды — нет). Значения должны помещаться в int64, иначе будет OverflowError.
+
+    Возвращает:
+        FlatTree (с обычным списком уровней сравнивается через ==).
+    """
+    root: int = int(data["root"])
+    height: int = max(int(data["height"]), 1)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    split = _choose_split_level(height, workers)
+    if workers <= 1 or split == height - 1:
+        # Дерево слишком маленькое, процессы только помешают.
+        return FlatTree.build(data, left_fn, right_fn, _TYPECODE)
+
+    node_count = (1 << height) - 1
+    shm = shared_memory.SharedMemory(create=True, size=node_count * _ITEMSIZE)
+    try:
+        view = memoryview(shm.buf).cast(_TYPECODE)
+        try:
+            top: List[int] = []
+            for level, top in enumerate(iter_levels({"root": root, "height": split + 1},
+                                                    left_fn, right_fn)):
+                view[(1 << level) - 1:(1 << (level + 1)) - 1] = array(_TYPECODE, top)
+
+            tasks: List[_SubtreeTask] = [
+                (shm.name, height, split, j, value, left_fn, right_fn)
+                for j, value in enumerate(top)
+            ]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # list() нужен, чтобы дождаться всех и поднять ошибку из процесса.
+                list(pool.map(_build_subtree_into_shared, tasks))
+
+            # Копирую один раз прямо из общей памяти (без промежуточного bytes),
+            # так что в пике дерево лежит в памяти дважды, а не трижды.
+            buffer = array(_TYPECODE)
+            buffer.frombytes(shm.buf[:node_count * _ITEMSIZE])
+        finally:
+            view.release()
+    finally:
+        shm.close()
+        shm.unlink()
+    return FlatTree(buffer, height)
+
+
+if __name__ == "__main__":
+    # Сравниваю с обычным build_tree_iterative на нескольких высотах.
+    root = 14
+    workers = os.cpu_count() or 1
+    print(f"Процессов: {workers}")
+    print("{:<8} {:>12} {:>12}".format("height", "iterative", "parallel"))
+    for h in range(16, 23, 2):
+        demo = {"root": root, "height": h}
+        t_it = min(timeit.repeat(
+            lambda: build_tree_iterative(demo, left_child_variant_14, right_child_variant_14),
+            repeat=3, number=1))
+        t_par = min(timeit.repeat(
+            lambda: build_tree_parallel(demo, workers=workers),
+            repeat=3, number=1))
+        print("{:<8} {:>12.4f} {:>12.4f}".format(h, t_it, t_par))
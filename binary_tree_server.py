@@ -0,0 +1,221 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from binary_tree_step3 import (
+    build_tree_iterative,
+    left_child_variant_14,
+    node_value,
+    right_child_variant_14,
+)
+
+
+# ---------------- Кэш готовых деревьев ----------------
+class TreeCache:
+    """
+    LRU-кэш построенных деревьев (root, height) -> уровни.
+    Ограничен не числом деревьев, а суммой узлов (max_nodes): одно дерево
+    высоты 20 весит как тысяча деревьев высоты 10.
+    """
+
+    def __init__(self, max_nodes: int = 1 << 22) -> None:
+        self.max_nodes = max_nodes
+        self._trees: "OrderedDict[Tuple[int, int], List[List[int]]]" = OrderedDict()
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[int, int]) -> Optional[List[List[int]]]:
+        levels = self._trees.get(key)
+        if levels is None:
+            self.misses += 1
+            return None
+        self._trees.move_to_end(key)
+        self.hits += 1
+        return levels
+
+    def put(self, key: Tuple[int, int], levels: List[List[int]]) -> None:
+        size = (1 << len(levels)) - 1
+        if size > self.max_nodes or key in self._trees:
+            return
+        while self.nodes + size > self.max_nodes:
+            (_, old_height), _ = self._trees.popitem(last=False)
+            self.nodes -= (1 << old_height) - 1
+            self.evictions += 1
+        self._trees[key] = levels
+        self.nodes += size
+
+    def find_level(self, root: int, level: int) -> Optional[List[int]]:
+        """
+        Уровень level из любого закэшированного дерева с этим корнем (если оно достаточно высокое).
+        Это тоже попадание: дерево становится самым свежим и считается в hits.
+        """
+        for key, levels in self._trees.items():
+            r, height = key
+            if r == root and level < height:
+                self._trees.move_to_end(key)
+                self.hits += 1
+                return levels[level]
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "trees": len(self._trees),
+            "nodes": self.nodes,
+            "max_nodes": self.max_nodes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# ---------------- Сервер: JSON по строкам ----------------
+class TreeServer:
+    """
+    Локальный сервис запросов к деревьям варианта №14.
+
+    Протокол — JSON-строки (одна строка запрос, одна строка ответ), через
+    TCP на localhost или Unix-сокет. Операции:
+        {"op": "build", "root": 14, "height": 16}
+        {"op": "level", "root": 14, "height": 16, "level": 10, "start": 0, "stop": 32}
+        {"op": "node",  "root": 14, "level": 40, "index": 12345}
+        {"op": "stats"}
+    Ответ: {"ok": true, ...} или {"ok": false, "error": "..."}.
+
+    Построение (build_tree_iterative) идёт в пуле потоков через run_in_executor,
+    поэтому цикл событий продолжает отвечать другим клиентам, пока строится
+    большое дерево. Одинаковые построения, пришедшие одновременно, склеиваю:
+    второй клиент ждёт то же самое future, а не строит дерево ещё раз.
+
+    node без дерева в кэше считается через node_value (тоже в пуле потоков).
+    Его цена растёт с уровнем примерно квадратично (числа длиной ~level бит),
+    поэтому уровень ограничен max_level.
+    """
+
+    def __init__(self, max_nodes: int = 1 << 22, max_height: int = 22, max_level: int = 4096) -> None:
+        self.cache = TreeCache(max_nodes)
+        self.max_height = max_height
+        self.max_level = max_level
+        self._building: Dict[Tuple[int, int], "asyncio.Future[List[List[int]]]"] = {}
+        self.requests = 0
+
+    async def get_tree(self, root: int, height: int) -> Tuple[List[List[int]], bool]:
+        """Уровни дерева и флаг "взято из кэша"."""
+        if not 1 <= height <= self.max_height:
+            raise ValueError(f"height должна быть от 1 до {self.max_height}")
+        key = (root, height)
+        levels = self.cache.get(key)
+        if levels is not None:
+            return levels, True
+        pending = self._building.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending), False
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            None, build_tree_iterative, {"root": root, "height": height},
+            left_child_variant_14, right_child_variant_14,
+        )
+        self._building[key] = future
+        try:
+            # shield: если этот клиент отвалится, построение для остальных не отменяется.
+            levels = await asyncio.shield(future)
+        finally:
+            del self._building[key]
+        self.cache.put(key, levels)
+        return levels, False
+
+    async def handle_request(self, request: Any) -> Dict[str, Any]:
+        if not isinstance(request, dict):
+            raise ValueError("запрос должен быть JSON-объектом")
+        op = request.get("op")
+        if op == "build":
+            levels, cached = await self.get_tree(int(request["root"]), int(request["height"]))
+            return {"ok": True, "height": len(levels), "nodes": (1 << len(levels)) - 1, "cached": cached}
+        if op == "level":
+            height = int(request["height"])
+            level = int(request["level"])
+            if not 0 <= level < height:
+                raise ValueError(f"уровень {level} вне дерева высоты {height}")
+            levels, cached = await self.get_tree(int(request["root"]), height)
+            start = int(request.get("start", 0))
+            stop = request.get("stop")
+            values = levels[level][start:None if stop is None else int(stop)]
+            return {"ok": True, "values": values, "cached": cached}
+        if op == "node":
+            root, level, index = int(request["root"]), int(request["level"]), int(request["index"])
+            if not 0 <= level < self.max_level:
+                raise ValueError(f"level должен быть от 0 до {self.max_level - 1}")
+            cached_level = self.cache.find_level(root, level)
+            if cached_level is not None and 0 <= index < len(cached_level):
+                return {"ok": True, "value": cached_level[index], "cached": True}
+            # Дерева в кэше нет — считаю один узел по пути от корня, без построения.
+            loop = asyncio.get_running_loop()
+            value = await loop.run_in_executor(None, node_value, root, level, index)
+            return {"ok": True, "value": value, "cached": False}
+        if op == "stats":
+            return {"ok": True, "requests": self.requests, **self.cache.stats()}
+        raise ValueError(f"неизвестная операция {op!r}")
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.requests += 1
+                try:
+                    # Сериализую тоже внутри try: слишком длинный int json не запишет (ValueError).
+                    payload = json.dumps(await self.handle_request(json.loads(line)))
+                except (KeyError, TypeError, ValueError, IndexError, OverflowError, AttributeError) as e:
+                    # KeyError — не хватает поля; json.JSONDecodeError — подкласс ValueError;
+                    # OverflowError — int() от inf (например, 1.5e400 в JSON).
+                    payload = json.dumps({"ok": False, "error": f"{type(e).__name__}: {e}"})
+                writer.write(payload.encode() + b"\n")
+                await writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765,
+                    unix_path: Optional[str] = None) -> None:
+        """Запускаю сервер и обслуживаю клиентов, пока процесс не остановят."""
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, unix_path)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+            where = f"{host}:{port}"
+        print(f"Сервер деревьев слушает {where}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Локальный сервер запросов к деревьям варианта №14")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="путь Unix-сокета (вместо TCP)")
+    parser.add_argument("--max-nodes", type=int, default=1 << 22,
+                        help="сколько узлов всего держать в кэше")
+    parser.add_argument("--max-height", type=int, default=22)
+    parser.add_argument("--max-level", type=int, default=4096,
+                        help="самый глубокий уровень для node без построения дерева")
+    args = parser.parse_args(argv)
+
+    server = TreeServer(args.max_nodes, args.max_height, args.max_level)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
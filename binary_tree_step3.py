@@ -1,9 +1,37 @@
 from __future__ import annotations
 import csv
+import gc
+import json
+import os
+import platform
+import sys
+import time
 import timeit
-from functools import lru_cache
-from typing import Callable, Dict, List, Any, Tuple
-import matplotlib.pyplot as plt
+import tracemalloc
+from array import array
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Callable, Dict, Iterable, Iterator, List, Any, NamedTuple, Optional, Sequence, Tuple
+
+
+# matplotlib и numpy импортируются лениво: сам импорт модуля должен быть быстрым
+# (его вызывают из пакетных задач тысячи раз), а графики и numpy нужны не всегда.
+def _pyplot() -> Any:
+    """matplotlib.pyplot с безголовым бэкендом Agg: дисплей не нужен, PNG пишется и так."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+@lru_cache(maxsize=1)
+def _numpy() -> Any:
+    """numpy, если установлен, иначе None (тогда работает запасной путь на списках)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
 
 
 # ---------------- Правила варианта №14 ----------------
@@ -43,33 +71,216 @@ def right_child_variant_14_cached(value: int) -> int:
     return value * 2
 
 
+# ---------------- Подключаемый кэш значений потомков ----------------
+class ChildCache:
+    """
+    Кэш значений потомков, который можно передать построителям (cache=...).
+
+    В отличие от глобальных @lru_cache(maxsize=None) выше:
+      - размер можно ограничить, старые записи вытесняются;
+      - видно hits/misses/evictions;
+      - reset() очищает и записи, и счётчики, так что "холодный" и
+        "тёплый" прогоны можно мерить по отдельности.
+
+    Ключ — пара (функция, значение), поэтому один кэш обслуживает
+    и левую, и правую функцию. Наследники реализуют _lookup/_store/_clear.
+    """
+
+    _MISSING = object()
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key: Any) -> Any:
+        raise NotImplementedError
+
+    def _store(self, key: Any, value: int) -> None:
+        raise NotImplementedError
+
+    def _clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def wrap(self, fn: Callable[[int], int]) -> Callable[[int], int]:
+        """Функция с тем же поведением, что и fn, но через этот кэш."""
+        lookup = self._lookup
+        store = self._store
+        missing = self._MISSING
+
+        def cached(value: int) -> int:
+            key = (fn, value)
+            result = lookup(key)
+            if result is missing:
+                self.misses += 1
+                result = fn(value)
+                store(key, result)
+            else:
+                self.hits += 1
+            return result
+
+        cached.__wrapped__ = fn  # type: ignore[attr-defined]
+        return cached
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "kind": type(self).__name__,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def reset(self) -> None:
+        """Полностью холодный кэш: без записей и с нулевыми счётчиками."""
+        self._clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+class DictCache(ChildCache):
+    """Обычный dict без ограничения размера (как lru_cache(maxsize=None), но со сбросом)."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._data: Dict[Any, int] = {}
+
+    def _lookup(self, key: Any) -> Any:
+        return self._data.get(key, self._MISSING)
+
+    def _store(self, key: Any, value: int) -> None:
+        self._data[key] = value
+
+    def _clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LRUCache(ChildCache):
+    """Вытесняет запись, к которой дольше всего не обращались."""
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize должен быть положительным")
+        super().__init__()
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, int]" = OrderedDict()
+
+    def _lookup(self, key: Any) -> Any:
+        value = self._data.get(key, self._MISSING)
+        if value is not self._MISSING:
+            self._data.move_to_end(key)
+        return value
+
+    def _store(self, key: Any, value: int) -> None:
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LFUCache(ChildCache):
+    """
+    Вытесняет самую редко используемую запись (при равенстве — самую старую).
+    Записи разложены по корзинам частот, поэтому всё за O(1).
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize должен быть положительным")
+        super().__init__()
+        self.maxsize = maxsize
+        self._data: Dict[Any, int] = {}
+        self._freq: Dict[Any, int] = {}
+        self._buckets: Dict[int, "OrderedDict[Any, None]"] = {}
+        self._min_freq = 0
+
+    def _touch(self, key: Any) -> None:
+        freq = self._freq[key]
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._freq[key] = freq + 1
+        self._buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def _lookup(self, key: Any) -> Any:
+        value = self._data.get(key, self._MISSING)
+        if value is not self._MISSING:
+            self._touch(key)
+        return value
+
+    def _store(self, key: Any, value: int) -> None:
+        if key in self._data:
+            self._data[key] = value
+            self._touch(key)
+            return
+        if len(self._data) >= self.maxsize:
+            bucket = self._buckets[self._min_freq]
+            old_key, _ = bucket.popitem(last=False)
+            if not bucket:
+                del self._buckets[self._min_freq]
+            del self._data[old_key]
+            del self._freq[old_key]
+            self.evictions += 1
+        self._data[key] = value
+        self._freq[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_freq = 1
+
+    def _clear(self) -> None:
+        self._data.clear()
+        self._freq.clear()
+        self._buckets.clear()
+        self._min_freq = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def make_cache(kind: str, maxsize: int = 4096) -> ChildCache:
+    """Кэш по имени: "dict", "lru" или "lfu"."""
+    if kind == "dict":
+        return DictCache()
+    if kind == "lru":
+        return LRUCache(maxsize)
+    if kind == "lfu":
+        return LFUCache(maxsize)
+    raise ValueError(f"неизвестный кэш {kind!r}: нужно dict, lru или lfu")
+
+
 # ---------------- Построение дерева ----------------
-def build_tree_recursive(
+def iter_levels_recursive(
     data: Dict[str, Any],
     left_fn: Callable[[int], int],
     right_fn: Callable[[int], int],
-) -> List[List[int]]:
+) -> Iterator[List[int]]:
     """
-    Рекурсивное построение дерева.
-    Я возвращаю список уровней (levels), так нагляднее проверять.
-
-    Параметры:
-        data: словарь с "root" и "height".
-        left_fn, right_fn: функции, которые считают левого и правого потомков.
-                           Я сделал их параметрами, чтобы легко переключаться
-                           между кэш/без кэша.
-
-    Возвращает:
-        Список уровней, где levels[0] — корень.
+    Рекурсивный генератор уровней: отдаёт уровни по одному, сверху вниз.
+    Рекурсия та же, что и раньше, только вместо накопления в levels
+    каждый уровень сразу уходит наружу через yield.
     """
     root: int = int(data["root"])
     height: int = int(data["height"])
 
-    levels: List[List[int]] = [[root]]
-
-    def expand(level_index: int, current: List[int]) -> None:
+    def expand(level_index: int, current: List[int]) -> Iterator[List[int]]:
+        yield current
         # Если уже на нужной глубине, дальше не идём.
-        if level_index == height - 1:
+        if level_index >= height - 1:
             return
 
         next_level: List[int] = []
@@ -77,242 +288,3266 @@ def build_tree_recursive(
             next_level.append(left_fn(v))
             next_level.append(right_fn(v))
 
-        levels.append(next_level)
         # Рекурсивный шаг — углубляемся на следующий уровень
-        expand(level_index + 1, next_level)
+        yield from expand(level_index + 1, next_level)
 
-    expand(0, [root])
-    return levels
+    yield from expand(0, [root])
 
 
-def build_tree_iterative(
+def iter_levels(
     data: Dict[str, Any],
     left_fn: Callable[[int], int],
     right_fn: Callable[[int], int],
-) -> List[List[int]]:
+) -> Iterator[List[int]]:
     """
-    Нерекурсивное построение (через цикл).
-    Логику оставил такой же как в рекурсивной — просто без вызовов самой себя.
-
-    Параметры:
-        data: словарь с "root" и "height".
-        left_fn, right_fn: функции вычисления потомков (кэш/без кэша).
+    Потоковый режим: генератор, который отдаёт уровни по одному (levels[0] — корень).
 
-    Возвращает:
-        Список уровней, как и в рекурсивной версии.
+    Генератор держит только текущий уровень, поэтому если нужен лишь
+    нижний уровень или какие-то агрегаты по ходу, пиковая память —
+    это один уровень, а не всё дерево (раньше было примерно 2× нижнего уровня).
     """
     root: int = int(data["root"])
     height: int = int(data["height"])
 
-    levels: List[List[int]] = [[root]]
-    if height <= 1:
-        return levels
-
     current: List[int] = [root]
+    yield current
     for _ in range(1, height):
         nxt: List[int] = []
         for v in current:
             nxt.append(left_fn(v))
             nxt.append(right_fn(v))
-        levels.append(nxt)
+        yield nxt
         current = nxt
-    return levels
 
 
-# ---------------- Утилиты: бенчмарк, CSV, графики ----------------
-def time_function(fn: Callable[[], None], repeat: int = 7, number: int = 1) -> float:
+def _level_slice(
+    root: int,
+    level: int,
+    start: int,
+    stop: int,
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> List[int]:
     """
-    Маленькая обёртка для timeit: беру минимум из нескольких прогона.
-    Мне так проще получать стабильные цифры.
+    Кусок уровня levels[level][start:stop] без построения всего уровня.
+    Сначала поднимаюсь вверх и запоминаю, какие диапазоны родителей нужны
+    (каждый раз примерно вдвое короче), потом спускаюсь и раскрываю их.
+    Памяти нужно порядка 2 * (stop - start) + height.
     """
-    return min(timeit.repeat(fn, repeat=repeat, number=number))
+    bounds: List[Tuple[int, int]] = []
+    s, e = start, stop
+    for _ in range(level):
+        bounds.append((s, e))
+        s, e = s // 2, (e + 1) // 2
 
+    chunk: List[int] = [root][s:e]
+    for s, e in reversed(bounds):
+        children: List[int] = []
+        for v in chunk:
+            children.append(left_fn(v))
+            children.append(right_fn(v))
+        # Дети первого родителя начинаются с индекса 2 * (s // 2).
+        offset = s - 2 * (s // 2)
+        chunk = children[offset:offset + e - s]
+    return chunk
 
-def benchmark_by_heights(
-    builder_a: Callable[[Dict[str, Any], Callable[[int], int], Callable[[int], int]], List[List[int]]],
-    builder_b: Callable[[Dict[str, Any], Callable[[int], int], Callable[[int], int]], List[List[int]]],
-    left_a: Callable[[int], int], right_a: Callable[[int], int],
-    left_b: Callable[[int], int], right_b: Callable[[int], int],
-    root: int,
-    heights: List[int],
-    repeat: int = 7,
-    number: int = 1,
-) -> List[Tuple[int, float, float]]:
+
+def iter_level_chunks(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    chunk_size: int = 65536,
+) -> Iterator[Tuple[int, int, List[int]]]:
     """
-    Замер времени двух "реализаций" (builder_a vs builder_b) на наборах высот.
+    Потоковый режим по кускам: отдаёт (level_index, start, chunk),
+    где chunk == levels[level_index][start:start + chunk_size].
 
-    Я сделал универсально: можно подставить:
-      - рекурсивный/итеративный
-      - кэш/без кэша
+    Куски идут по уровням сверху вниз и слева направо. Каждый кусок
+    считается от корня через _level_slice, поэтому в памяти одновременно
+    живёт только один кусок (плюс его предки, они в сумме не больше куска).
+    Работы получается примерно вдвое больше, чем у iter_levels, —
+    это плата за ограниченную память.
     """
-    rows: List[Tuple[int, float, float]] = []
-    for h in heights:
-        data = {"root": root, "height": h}
+    if chunk_size <= 0:
+        raise ValueError("chunk_size должен быть положительным")
+    root: int = int(data["root"])
+    height: int = int(data["height"])
 
-        def run_a():
-            builder_a(data, left_a, right_a)
+    for level in range(max(height, 1)):
+        size = 1 << level
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            yield level, start, _level_slice(root, level, start, stop, left_fn, right_fn)
 
-        def run_b():
-            builder_b(data, left_b, right_b)
 
-        t_a = time_function(run_a, repeat=repeat, number=number)
-        t_b = time_function(run_b, repeat=repeat, number=number)
-        rows.append((h, t_a, t_b))
-    return rows
+# ---------------- Наблюдатели за построением по уровням ----------------
+class LevelObserver:
+    """
+    Наблюдатель за построением: build_tree_recursive/build_tree_iterative
+    вызывают on_level после каждого готового уровня.
 
+    Параметры on_level:
+        level_index     — номер уровня (0 — корень);
+        elapsed         — сколько секунд строился этот уровень;
+        node_count      — узлов на уровне;
+        allocated_bytes — сколько занимает уровень (список + объекты int);
+        max_bit_length  — самое длинное значение в битах (видно, когда пошли big int).
 
-def save_csv(rows: List[Tuple[int, float, float]], path: str, header_a: str, header_b: str) -> None:
+    Базовый класс ничего не делает, от него удобно наследоваться.
     """
-    Сохраняю результаты в CSV: height, A, B.
-    (Мне так удобнее потом вклеивать в отчёт.)
+
+    def on_level(
+        self,
+        level_index: int,
+        elapsed: float,
+        node_count: int,
+        allocated_bytes: int,
+        max_bit_length: int,
+    ) -> None:
+        pass
+
+
+class LevelStatsCollector(LevelObserver):
+    """
+    Встроенный сборщик: копит строки по уровням, умеет
+    сохранять их в CSV и выдавать flame-сводку (folded stacks).
+    Один сборщик можно передать в несколько построений подряд —
+    строки различаются по label.
     """
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["height", header_a, header_b])
-        for h, a, b in rows:
-            w.writerow([h, f"{a:.8f}", f"{b:.8f}"])
 
+    _FIELDS = ["label", "level", "elapsed", "node_count", "allocated_bytes", "max_bit_length"]
 
-def plot_two_series(
-    rows: List[Tuple[int, float, float]],
-    label_a: str,
-    label_b: str,
-    title: str,
-    path: str,
-) -> None:
+    def __init__(self, label: str = "build_tree") -> None:
+        self.label = label
+        self.rows: List[Dict[str, Any]] = []
+
+    def on_level(
+        self,
+        level_index: int,
+        elapsed: float,
+        node_count: int,
+        allocated_bytes: int,
+        max_bit_length: int,
+    ) -> None:
+        self.rows.append({
+            "label": self.label,
+            "level": level_index,
+            "elapsed": elapsed,
+            "node_count": node_count,
+            "allocated_bytes": allocated_bytes,
+            "max_bit_length": max_bit_length,
+        })
+
+    def to_csv(self, path: str) -> None:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=self._FIELDS)
+            w.writeheader()
+            for row in self.rows:
+                w.writerow({**row, "elapsed": f"{row['elapsed']:.9f}"})
+
+    def flame_summary(self) -> str:
+        """
+        Сводка в формате folded stacks ("label;level_03 123"), значения — микросекунды.
+        Её можно сразу отдать flamegraph.pl или speedscope.
+        """
+        lines = [
+            f"{row['label']};level_{row['level']:02d} {max(1, round(row['elapsed'] * 1e6))}"
+            for row in self.rows
+        ]
+        return "\n".join(lines)
+
+
+def _level_allocated_bytes(level: List[int]) -> int:
+    """Размер списка плюс размеры объектов int в нём (общие int считаются несколько раз)."""
+    return sys.getsizeof(level) + sum(map(sys.getsizeof, level))
+
+
+def _observe_levels(levels: Iterator[List[int]], observer: LevelObserver) -> Iterator[List[int]]:
     """
-    Рисую один график с двумя линиями.
-    По оси X — высота дерева, по оси Y — секунды.
+    Оборачиваю генератор уровней: засекаю время до каждого готового уровня
+    и отдаю статистику наблюдателю. Байты и длину в битах считаю уже
+    после засечки, чтобы они не попадали во время уровня.
     """
-    heights = [r[0] for r in rows]
-    series_a = [r[1] for r in rows]
-    series_b = [r[2] for r in rows]
+    level_index = 0
+    start = time.perf_counter()
+    for level in levels:
+        elapsed = time.perf_counter() - start
+        max_bits = max(abs(min(level)), abs(max(level))).bit_length()
+        observer.on_level(level_index, elapsed, len(level), _level_allocated_bytes(level), max_bits)
+        yield level
+        level_index += 1
+        start = time.perf_counter()
 
-    plt.figure()
-    plt.plot(heights, series_a, marker="o", label=label_a)
-    plt.plot(heights, series_b, marker="o", label=label_b)
-    plt.xlabel("height")
-    plt.ylabel("seconds")
-    plt.title(title)
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(path, dpi=120)
-    # Если нужно окно — раскомментируйте:
-    # plt.show()
 
+def build_tree_recursive(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    observer: Optional[LevelObserver] = None,
+    cache: Optional[ChildCache] = None,
+) -> List[List[int]]:
+    """
+    Рекурсивное построение дерева.
+    Я возвращаю список уровней (levels), так нагляднее проверять.
+    Сама рекурсия теперь живёт в iter_levels_recursive, здесь только собираю уровни.
+
+    Параметры:
+        data: словарь с "root" и "height".
+        left_fn, right_fn: функции, которые считают левого и правого потомков.
+                           Я сделал их параметрами, чтобы легко переключаться
+                           между кэш/без кэша.
+        observer: необязательный LevelObserver, получает статистику по уровням.
+                  Без него путь тот же, что и раньше, — никаких лишних затрат.
+        cache: необязательный ChildCache (DictCache/LRUCache/LFUCache),
+               через который идут вызовы left_fn/right_fn.
 
-def sanity_check_same_structure() -> None:
+    Возвращает:
+        Список уровней, где levels[0] — корень.
     """
-    Я на всякий случай проверяю, что базовые версии дают одинаковые уровни.
-    Это не строгий тест, просто чтобы самому убедиться.
+    if cache is not None:
+        left_fn, right_fn = cache.wrap(left_fn), cache.wrap(right_fn)
+    if observer is None:
+        return list(iter_levels_recursive(data, left_fn, right_fn))
+    return list(_observe_levels(iter_levels_recursive(data, left_fn, right_fn), observer))
+
+
+def build_tree_iterative(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    observer: Optional[LevelObserver] = None,
+    cache: Optional[ChildCache] = None,
+) -> List[List[int]]:
     """
-    data = {"root": 14, "height": 4}
-    base_rec = build_tree_recursive(data, left_child_variant_14, right_child_variant_14)
-    base_it = build_tree_iterative(data, left_child_variant_14, right_child_variant_14)
-    print("Совпадают ли уровни (recursive vs iterative, без кэша) при height=4? ->",
-          "Да" if base_rec == base_it else "Нет")
+    Нерекурсивное построение (через цикл).
+    Логику оставил такой же как в рекурсивной — просто без вызовов самой себя.
+    Цикл живёт в iter_levels, здесь только собираю уровни в список.
+
+    Параметры:
+        data: словарь с "root" и "height".
+        left_fn, right_fn: функции вычисления потомков (кэш/без кэша).
+        observer: необязательный LevelObserver (как в рекурсивной версии).
+        cache: необязательный ChildCache (как в рекурсивной версии).
+
+    Возвращает:
+        Список уровней, как и в рекурсивной версии.
+    """
+    if cache is not None:
+        left_fn, right_fn = cache.wrap(left_fn), cache.wrap(right_fn)
+    if observer is None:
+        return list(iter_levels(data, left_fn, right_fn))
+    return list(_observe_levels(iter_levels(data, left_fn, right_fn), observer))
 
 
-# ---------------- Главный сценарий: 4 сравнения и 4 графика ----------------
-def main() -> None:
+class TreeBuilder:
     """
-    Здесь я запускаю четыре эксперимента из твоего списка:
+    Построитель с состоянием: держит уже построенные уровни и умеет
+    достраивать дерево до нужной высоты, не начиная с корня.
 
-    1) Рекурсивный и нерекурсивный (оба без кэша)
-    2) Рекурсивный без кэша и рекурсивный с кэшем
-    3) Нерекурсивный без кэша и с кэшем
-    4) Рекурсивный и нерекурсивный с кэшем
+    Дерево высоты h+1 — это дерево высоты h плюс один уровень,
+    поэтому проход по высотам 4..N через extend_to стоит примерно
+    как одно построение высоты N. truncate просто отрезает лишние уровни.
+    """
 
-    Для каждого делаю отдельный CSV и отдельный PNG.
-    Высоты можно поменять ниже (heights_to_test).
+    def __init__(
+        self,
+        root: int,
+        left_fn: Callable[[int], int] = left_child_variant_14,
+        right_fn: Callable[[int], int] = right_child_variant_14,
+    ) -> None:
+        self.left_fn = left_fn
+        self.right_fn = right_fn
+        self.levels: List[List[int]] = [[int(root)]]
+
+    @property
+    def height(self) -> int:
+        return len(self.levels)
+
+    def extend_to(self, height: int) -> List[List[int]]:
+        """
+        Достраиваю уровни до height (если их меньше) и возвращаю
+        первые height уровней — как build_tree_iterative для той же высоты.
+        Сами уровни не копируются, копируется только внешний список.
+        """
+        left_fn, right_fn = self.left_fn, self.right_fn
+        current = self.levels[-1]
+        while len(self.levels) < height:
+            nxt: List[int] = []
+            for v in current:
+                nxt.append(left_fn(v))
+                nxt.append(right_fn(v))
+            self.levels.append(nxt)
+            current = nxt
+        return self.levels[:max(height, 1)]
+
+    def truncate(self, height: int) -> None:
+        """Оставляю только первые height уровней (корень остаётся всегда)."""
+        del self.levels[max(height, 1):]
+
+
+def sweep_heights(
+    root: int,
+    heights: Iterable[int],
+    left_fn: Callable[[int], int] = left_child_variant_14,
+    right_fn: Callable[[int], int] = right_child_variant_14,
+) -> Iterator[Tuple[int, List[List[int]]]]:
     """
-    sanity_check_same_structure()
+    Проход по высотам с одним TreeBuilder: отдаёт (height, levels).
+    Высоты можно давать в любом порядке — при уменьшении дерево обрезается.
+    """
+    builder = TreeBuilder(root, left_fn, right_fn)
+    for h in heights:
+        if h < builder.height:
+            builder.truncate(h)
+        yield h, builder.extend_to(h)
 
-    root = 14
-    heights_to_test = list(range(4, 17))  # 2..12 достаточно, чтобы был тренд
-    repeat = 9
-    number = 50
 
-    # 1) recursive(no cache) vs iterative(no cache)
-    rows1 = benchmark_by_heights(
-        build_tree_recursive, build_tree_iterative,
-        left_child_variant_14, right_child_variant_14,
-        left_child_variant_14, right_child_variant_14,
-        root, heights_to_test, repeat, number
-    )
-    save_csv(rows1, "exp1_rec_vs_it_no_cache.csv", "recursive_nc", "iterative_nc")
-    plot_two_series(
-        rows1,
-        "recursive (no cache)",
-        "iterative (no cache)",
-        "Сравнение: рекурсивный vs нерекурсивный (без кэша)",
-        "exp1_rec_vs_it_no_cache.png",
-    )
+# Порог, после которого следующий уровень может не влезть в int64.
+# Беру с запасом: при |v| < 2**61 и 3 - v, и v * 2 гарантированно помещаются.
+_INT64_SAFE_LIMIT = 2 ** 61
 
-    # 2) recursive(no cache) vs recursive(cached)
-    rows2 = benchmark_by_heights(
-        
-        build_tree_recursive, build_tree_recursive,
-        left_child_variant_14, right_child_variant_14,
-        left_child_variant_14_cached, right_child_variant_14_cached,
-        root, heights_to_test, repeat, number
-    )
-    save_csv(rows2, "exp2_rec_nc_vs_rec_cached.csv", "recursive_nc", "recursive_cached")
-    plot_two_series(
-        rows2,
-        "recursive (no cache)",
-        "recursive (cached)",
-        "Сравнение: рекурсивный без кэша vs рекурсивный с кэшем",
-        "exp2_rec_nc_vs_rec_cached.png",
-    )
 
-    # 3) iterative(no cache) vs iterative(cached)
-    rows3 = benchmark_by_heights(
-        build_tree_iterative, build_tree_iterative,
-        left_child_variant_14, right_child_variant_14,
-        left_child_variant_14_cached, right_child_variant_14_cached,
-        root, heights_to_test, repeat, number
-    )
-    save_csv(rows3, "exp3_it_nc_vs_it_cached.csv", "iterative_nc", "iterative_cached")
-    plot_two_series(
-        rows3,
-        "iterative (no cache)",
-        "iterative (cached)",
-        "Сравнение: нерекурсивный без кэша vs нерекурсивный с кэшем",
-        "exp3_it_nc_vs_it_cached.png",
-    )
+def _unwrap_child_fn(fn: Callable[[int], int]) -> Callable[[int], int]:
+    """
+    lru_cache не принимает массивы (они не хешируются),
+    поэтому для векторного режима достаю исходную функцию.
+    """
+    return getattr(fn, "__wrapped__", fn)
 
-    # 4) recursive(cached) vs iterative(cached)
-    rows4 = benchmark_by_heights(
-        build_tree_recursive, build_tree_iterative,
-        left_child_variant_14_cached, right_child_variant_14_cached,
-        left_child_variant_14_cached, right_child_variant_14_cached,
-        root, heights_to_test, repeat, number
-    )
-    save_csv(rows4, "exp4_rec_cached_vs_it_cached.csv", "recursive_cached", "iterative_cached")
-    plot_two_series(
-        rows4,
-        "recursive (cached)",
-        "iterative (cached)",
-        "Сравнение: рекурсивный vs нерекурсивный (оба с кэшем)",
-        "exp4_rec_cached_vs_it_cached.png",
-    )
 
-    print("\nГотово. Сохранены 4 CSV и 4 PNG для всех сравнений.")
-    print("Файлы:")
-    print(" - exp1_rec_vs_it_no_cache.csv / .png")
-    print(" - exp2_rec_nc_vs_rec_cached.csv / .png")
-    print(" - exp3_it_nc_vs_it_cached.csv / .png")
-    print(" - exp4_rec_cached_vs_it_cached.csv / .png")
-    print("\nКороткий комментарий:")
-    print(
-        "Кэширование ускоряет случаи, где часто повторяются одинаковые входы для функций\n"
-        "вычисления потомков. В нашей задаче это может проявляться, когда значения узлов\n"
-        "на разных позициях совпадают. Итеративный подход обычно и так немного быстрее,\n"
-        "но с кэшем обе версии выигрывают. Точный эффект зависит от высоты и повтора значений."
-    )
+def build_tree_numpy(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> List[List[int]]:
+    """
+    Векторное построение: каждый уровень считается из предыдущего целиком,
+    операциями над массивом, а не вызовами left_fn/right_fn на каждый узел.
+
+    left_fn и right_fn применяются сразу ко всему массиву уровня
+    (для правил варианта №14 это просто 3 - arr и arr * 2), результаты
+    чередуются в один буфер: чётные позиции — левые потомки, нечётные — правые.
+
+    Пока значения помещаются в int64, считаю в int64. Когда модуль значений
+    доходит до _INT64_SAFE_LIMIT, перехожу на dtype=object (обычные int Python),
+    поэтому результат совпадает с build_tree_iterative на любой высоте.
+    Про произвольные функции я не знаю, как быстро они растят значения,
+    поэтому каждый уровень в int64 проверяю (_int64_level_exact) и при
+    переполнении пересчитываю его уже в object.
+
+    Без numpy работает тот же приём на списках: срезовое присваивание
+    nxt[0::2] = map(left_fn, current).
+
+    Если пару функций удаётся узнать как AffineRule (rule_from_callables),
+    уровни строит векторное ядро скомпилированного правила.
+
+    Возвращает:
+        Список уровней (List[List[int]]), как и остальные построители.
+    """
+    root: int = int(data["root"])
+    height: int = int(data["height"])
+    rule = rule_from_callables(left_fn, right_fn)
+    if rule is not None:
+        # Знакомое аффинное правило: у скомпилированного ядра точная граница
+        # для int64 и отдельный путь для модуля 2**64.
+        return list(compile_rule(rule).iter_levels(root, height, "vectorized"))
+    left = _unwrap_child_fn(left_fn)
+    right = _unwrap_child_fn(right_fn)
+    return list(_iter_levels_vectorized(root, height, left, right, _INT64_SAFE_LIMIT, check=True))
+
+
+def _iter_levels_vectorized(
+    root: int,
+    height: int,
+    left: Callable[[Any], Any],
+    right: Callable[[Any], Any],
+    safe_limit: int,
+    check: bool = False,
+) -> Iterator[List[int]]:
+    """
+    Общий векторный цикл для build_tree_numpy и скомпилированных правил.
+    safe_limit — граница модуля значений, ниже которой следующий уровень
+    точно помещается в int64 (для AffineRule она точная). check=True —
+    для незнакомых функций, у которых такой границы нет: каждый уровень
+    в int64 проверяю через _int64_level_exact.
+    """
+    yield [root]
+    if height <= 1:
+        return
+
+    np = _numpy()
+    if np is None:
+        current: List[int] = [root]
+        for _ in range(1, height):
+            nxt: List[int] = [0] * (2 * len(current))
+            nxt[0::2] = map(left, current)
+            nxt[1::2] = map(right, current)
+            yield nxt
+            current = nxt
+        return
+
+    dtype = np.int64 if abs(root) < safe_limit else object
+    arr = np.array([root], dtype=dtype)
+    for _ in range(1, height):
+        if arr.dtype != object and int(np.abs(arr).max()) >= safe_limit:
+            # Дальше int64 может переполниться — переключаюсь на big int.
+            arr = arr.astype(object)
+        nxt_arr = np.empty(2 * arr.size, dtype=arr.dtype)
+        nxt_arr[0::2] = left(arr)
+        nxt_arr[1::2] = right(arr)
+        if check and arr.dtype != object and not _int64_level_exact(np, arr, nxt_arr, left, right, safe_limit):
+            # int64 переполнился (может быть, в промежуточном значении) — пересчитываю уровень в big int.
+            arr = arr.astype(object)
+            nxt_arr = np.empty(2 * arr.size, dtype=object)
+            nxt_arr[0::2] = left(arr)
+            nxt_arr[1::2] = right(arr)
+        yield nxt_arr.tolist()
+        arr = nxt_arr
+
+
+def _int64_level_exact(
+    np: Any,
+    arr: Any,
+    nxt_arr: Any,
+    left: Callable[[Any], Any],
+    right: Callable[[Any], Any],
+    safe_limit: int,
+) -> bool:
+    """
+    Проверяю уровень nxt_arr, посчитанный в int64 из arr произвольными left/right.
+
+    Те же функции на float64-копии arr не заворачиваются при переполнении,
+    а только теряют точность. Если там модуль дошёл до safe_limit или
+    int64 разошёлся с float64 — где-то было переполнение. Если функции
+    на float не работают (побитовые операции и т.п.), проверить нельзя,
+    и я честно возвращаю False.
+    """
+    shadow = arr.astype(np.float64)
+    expected = np.empty(nxt_arr.size, dtype=np.float64)
+    try:
+        with np.errstate(all="ignore"):
+            expected[0::2] = left(shadow)
+            expected[1::2] = right(shadow)
+    except TypeError:
+        return False
+    if not np.all(np.abs(expected) < safe_limit):
+        return False
+    return bool(np.allclose(nxt_arr, expected, rtol=1e-9, atol=0))
+
+
+# ---------------- Правила как аффинные отображения ----------------
+class AffineRule(NamedTuple):
+    """
+    Описание правил потомков как аффинных отображений:
+        left = a * v + b,   right = c * v + d.
+
+    Вариант №14 — это AffineRule(-1, 3, 2, 0, rule_id=14).
+    В отличие от произвольных left_fn/right_fn такое описание можно
+    "скомпилировать" в быстрые ядра (см. compile_rule), обратить и
+    посчитать в замкнутом виде. Для других вариантов лабы достаточно
+    завести свой AffineRule — быстрые пути заработают сами.
+
+    rule.left и rule.right — обычные функции от int, поэтому правило
+    можно передавать и в старые построители: build_tree_iterative(data, rule.left, rule.right).
+
+    modulus != 0 включает модульный режим: все значения берутся по модулю
+    (например, 2**64), так что числа не растут в big int. Точные значения
+    при этом теряются, но для хешей и отпечатков они и не нужны.
+    """
+
+    a: int
+    b: int
+    c: int
+    d: int
+    rule_id: int = 0
+    modulus: int = 0
+
+    def left(self, value: int) -> int:
+        if self.modulus:
+            return (self.a * value + self.b) % self.modulus
+        return self.a * value + self.b
+
+    def right(self, value: int) -> int:
+        if self.modulus:
+            return (self.c * value + self.d) % self.modulus
+        return self.c * value + self.d
+
+    def with_modulus(self, modulus: int) -> "AffineRule":
+        """То же правило, но по модулю modulus (0 — обычный точный режим)."""
+        if modulus < 0 or modulus == 1:
+            raise ValueError("модуль должен быть 0 (без модуля) или больше 1")
+        return self._replace(modulus=modulus)
+
+
+VARIANT_14 = AffineRule(-1, 3, 2, 0, rule_id=14)
+
+# Модуль по умолчанию для модульного режима: значения помещаются в uint64.
+MOD64 = 2 ** 64
+
+
+def _affine_expr(mul: int, add: int) -> str:
+    """Текст выражения mul * v + add без лишних операций (для генерации ядра)."""
+    if mul == 0:
+        return repr(add)
+    if mul == 1:
+        term = "v"
+    elif mul == -1:
+        term = "-v"
+    else:
+        term = f"v * {mul}"
+    if add == 0:
+        return term
+    if mul == -1:
+        return f"{add} - v"
+    return f"{term} + {add}" if add > 0 else f"{term} - {-add}"
+
+
+def _modular_expr(expr: str, modulus: int) -> str:
+    """Добавляю взятие по модулю; для степени двойки хватает маски (& работает и для отрицательных)."""
+    if not modulus:
+        return expr
+    if modulus & (modulus - 1) == 0:
+        return f"({expr}) & {modulus - 1}"
+    return f"({expr}) % {modulus}"
+
+
+class CompiledRule:
+    """
+    Скомпилированное аффинное правило. Три ядра:
+
+    - "python": цикл, сгенерированный под конкретные коэффициенты
+      (для варианта №14 это буквально [3 - v for v in current] и [v * 2 ...]),
+      без вызова функции на каждый узел;
+    - "vectorized": уровень целиком через numpy (или срезы списков без numpy);
+    - "closed": замкнутая форма. Каждый узел уровня k равен P[i] * root + Q[i],
+      где векторы P и Q не зависят от корня (их даёт iter_coefficients).
+      Между вызовами я их не храню: на высоте 20 это десятки мегабайт,
+      а compile_rule держит объект правила до конца процесса.
+    """
+
+    def __init__(self, rule: AffineRule) -> None:
+        self.rule = rule
+        source = (
+            "def expand(current):\n"
+            "    nxt = [0] * (2 * len(current))\n"
+            f"    nxt[0::2] = [{_modular_expr(_affine_expr(rule.a, rule.b), rule.modulus)} for v in current]\n"
+            f"    nxt[1::2] = [{_modular_expr(_affine_expr(rule.c, rule.d), rule.modulus)} for v in current]\n"
+            "    return nxt\n"
+        )
+        namespace: Dict[str, Any] = {}
+        exec(source, namespace)
+        self.expand: Callable[[List[int]], List[int]] = namespace["expand"]
+        self.source = source
+
+        # Граница, ниже которой a * v + b и c * v + d точно влезают в int64.
+        # В модульном режиме значения меньше модуля, так что если модуль
+        # ниже этой границы, векторный путь так и останется в int64.
+        grow = max(abs(rule.a), abs(rule.c), 1)
+        shift = max(abs(rule.b), abs(rule.d))
+        self._safe_limit = max((2 ** 63 - 1 - shift) // grow, 0)
+
+    def iter_coefficients(self, height: int) -> Iterator[Tuple[List[int], List[int]]]:
+        """
+        Векторы (P, Q) уровней 0..height-1: значение узла i уровня равно P[i] * root + Q[i].
+        Каждый следующий уровень считается из предыдущего, старые не храню.
+        """
+        rule = self.rule
+        p_vec: List[int] = [1]
+        q_vec: List[int] = [0]
+        for level in range(max(height, 1)):
+            if level:
+                p_next: List[int] = [0] * (2 * len(p_vec))
+                q_next: List[int] = [0] * (2 * len(q_vec))
+                p_next[0::2] = [rule.a * p for p in p_vec]
+                p_next[1::2] = [rule.c * p for p in p_vec]
+                q_next[0::2] = [rule.a * q + rule.b for q in q_vec]
+                q_next[1::2] = [rule.c * q + rule.d for q in q_vec]
+                if rule.modulus:
+                    p_next = [p % rule.modulus for p in p_next]
+                    q_next = [q % rule.modulus for q in q_next]
+                p_vec, q_vec = p_next, q_next
+            yield p_vec, q_vec
+
+    def coefficients(self, level: int) -> Tuple[List[int], List[int]]:
+        """Векторы (P, Q) одного уровня level (считаются заново при каждом вызове)."""
+        for p_vec, q_vec in self.iter_coefficients(level + 1):
+            pass
+        return p_vec, q_vec
+
+    def level_closed_form(self, root: int, level: int) -> List[int]:
+        """Уровень level сразу по формуле, без значений предыдущих уровней."""
+        return self._apply_coefficients(root, *self.coefficients(level))
+
+    def _apply_coefficients(self, root: int, p_vec: List[int], q_vec: List[int]) -> List[int]:
+        if self.rule.modulus:
+            m = self.rule.modulus
+            return [(p * root + q) % m for p, q in zip(p_vec, q_vec)]
+        return [p * root + q for p, q in zip(p_vec, q_vec)]
+
+    def iter_levels(self, root: int, height: int, kernel: str = "python") -> Iterator[List[int]]:
+        """Уровни дерева выбранным ядром (как iter_levels, но без left_fn/right_fn)."""
+        if self.rule.modulus:
+            root %= self.rule.modulus
+        if kernel == "python":
+            current: List[int] = [root]
+            yield current
+            for _ in range(1, height):
+                current = self.expand(current)
+                yield current
+        elif kernel == "vectorized" and self.rule.modulus == MOD64 and _numpy() is not None:
+            yield from self._iter_levels_uint64(root, height)
+        elif kernel == "vectorized":
+            yield from _iter_levels_vectorized(
+                root, height, self.rule.left, self.rule.right, self._safe_limit
+            )
+        elif kernel == "closed":
+            for p_vec, q_vec in self.iter_coefficients(height):
+                yield self._apply_coefficients(root, p_vec, q_vec)
+        else:
+            raise ValueError(f"неизвестное ядро {kernel!r}: нужно python, vectorized или closed")
+
+    def _iter_levels_uint64(self, root: int, height: int) -> Iterator[List[int]]:
+        """
+        Модуль 2**64 в numpy бесплатный: арифметика uint64 и так идёт
+        с переполнением по модулю 2**64, поэтому никакого % не нужно.
+        Отрицательные коэффициенты заранее перевожу в uint64 (-1 -> 2**64 - 1).
+        """
+        np = _numpy()
+        a, b, c, d = (np.uint64(x % MOD64) for x in self.rule[:4])
+        arr = np.array([root], dtype=np.uint64)
+        yield [root]
+        for _ in range(1, height):
+            nxt = np.empty(2 * arr.size, dtype=np.uint64)
+            nxt[0::2] = a * arr + b
+            nxt[1::2] = c * arr + d
+            yield nxt.tolist()
+            arr = nxt
+
+    def __repr__(self) -> str:
+        return f"CompiledRule({self.rule!r})"
+
+
+@lru_cache(maxsize=32)
+def compile_rule(rule: AffineRule) -> CompiledRule:
+    """Компилирую правило один раз и дальше беру готовое из кэша."""
+    return CompiledRule(rule)
+
+
+def rule_from_callables(
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> Optional[AffineRule]:
+    """
+    Пытаюсь узнать аффинное правило по паре функций:
+    - rule.left / rule.right одного и того же AffineRule;
+    - известные функции варианта №14 (с кэшем и без).
+    Для произвольных функций возвращаю None — тогда остаётся медленный путь.
+    """
+    owner = getattr(left_fn, "__self__", None)
+    if isinstance(owner, AffineRule) and getattr(right_fn, "__self__", None) is owner:
+        return owner
+    return _KNOWN_RULES.get((left_fn, right_fn))
+
+
+_KNOWN_RULES: Dict[Tuple[Callable[[int], int], Callable[[int], int]], AffineRule] = {
+    (left_child_variant_14, right_child_variant_14): VARIANT_14,
+    (left_child_variant_14_cached, right_child_variant_14_cached): VARIANT_14,
+}
+
+
+def modular_children(
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    modulus: int = MOD64,
+) -> Tuple[Callable[[int], int], Callable[[int], int]]:
+    """
+    Модульный режим для любых построителей: возвращаю пару функций,
+    которые считают то же самое, но по модулю modulus.
+
+    Если пару удаётся узнать как AffineRule, возвращаю rule.left/rule.right
+    модульного правила — тогда build_tree_compiled сам выберет быстрое ядро
+    (а для 2**64 векторное ядро считает прямо в uint64). Иначе — обёртки с %.
+    Корень тоже стоит брать по модулю: data["root"] % modulus.
+    """
+    rule = rule_from_callables(left_fn, right_fn)
+    if rule is not None:
+        modular = rule.with_modulus(modulus)
+        return modular.left, modular.right
+
+    def left_mod(value: int) -> int:
+        return left_fn(value) % modulus
+
+    def right_mod(value: int) -> int:
+        return right_fn(value) % modulus
+
+    return left_mod, right_mod
+
+
+def build_tree_compiled(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    kernel: str = "python",
+) -> List[List[int]]:
+    """
+    Построитель с той же сигнатурой, что и остальные, но через скомпилированное правило.
+
+    Если пару функций удаётся узнать как AffineRule (rule_from_callables),
+    уровни строит быстрое ядро kernel. Иначе — медленный путь через
+    обычный build_tree_iterative, так что любые функции по-прежнему подходят.
+    """
+    rule = rule_from_callables(left_fn, right_fn)
+    if rule is None:
+        return build_tree_iterative(data, left_fn, right_fn)
+    root: int = int(data["root"])
+    height: int = int(data["height"])
+    return list(compile_rule(rule).iter_levels(root, height, kernel))
+
+
+# ---------------- Пакетное построение: много корней сразу ----------------
+def heap_row_to_levels(row: Sequence[int], height: int) -> List[List[int]]:
+    """Строка в порядке кучи (уровень k — индексы [2**k - 1, 2**(k+1) - 1)) -> список уровней."""
+    return [list(row[(1 << k) - 1:(1 << (k + 1)) - 1]) for k in range(height)]
+
+
+def build_tree_batch(
+    roots: Sequence[int],
+    height: int,
+    left_fn: Callable[[int], int] = left_child_variant_14,
+    right_fn: Callable[[int], int] = right_child_variant_14,
+) -> Any:
+    """
+    Деревья одной высоты сразу для многих корней — одним блоком
+    len(roots) x (2**height - 1): строка на корень, узлы в порядке кучи
+    (уровень k — столбцы [2**k - 1, 2**(k+1) - 1)). Строку обратно в уровни
+    превращает heap_row_to_levels.
+
+    Для аффинных правил (rule_from_callables) общая работа делается один раз:
+    узел i равен P[i] * root + Q[i], где P и Q зависят только от правила
+    и высоты (CompiledRule.iter_coefficients). Дальше весь блок — это
+    np.outer(roots, P) + Q. Пока значения влезают в int64, считаю в int64,
+    иначе в dtype=object. Для модуля 2**64 — сразу в uint64.
+
+    Для произвольных функций общих вычислений нет, поэтому просто
+    вызываю build_tree_iterative для каждого корня.
+
+    Возвращает:
+        numpy.ndarray формы (len(roots), 2**height - 1), если numpy есть,
+        иначе список строк (List[List[int]]).
+    """
+    height = max(int(height), 1)
+    roots = [int(r) for r in roots]
+    np = _numpy()
+    rule = rule_from_callables(left_fn, right_fn)
+
+    if rule is None:
+        rows = []
+        for root in roots:
+            levels = build_tree_iterative({"root": root, "height": height}, left_fn, right_fn)
+            rows.append([v for level in levels for v in level])
+        if np is None:
+            return rows
+        return _rows_to_array(np, rows, (1 << height) - 1)
+
+    compiled = compile_rule(rule)
+    p_all: List[int] = []
+    q_all: List[int] = []
+    for p_vec, q_vec in compiled.iter_coefficients(height):
+        p_all.extend(p_vec)
+        q_all.extend(q_vec)
+    m = rule.modulus
+    if m:
+        roots = [r % m for r in roots]
+
+    if np is None:
+        if m:
+            return [[(p * r + q) % m for p, q in zip(p_all, q_all)] for r in roots]
+        return [[p * r + q for p, q in zip(p_all, q_all)] for r in roots]
+
+    if m == MOD64:
+        # uint64 сам заворачивается по модулю 2**64 (см. _iter_levels_uint64).
+        block = np.outer(np.array(roots, dtype=np.uint64), np.array(p_all, dtype=np.uint64))
+        block += np.array(q_all, dtype=np.uint64)
+        return block
+
+    bound = (max((abs(p) for p in p_all), default=0) * max((abs(r) for r in roots), default=0)
+             + max((abs(q) for q in q_all), default=0))
+    dtype = np.int64 if bound < 2 ** 63 else object
+    block = np.outer(np.array(roots, dtype=dtype), np.array(p_all, dtype=dtype))
+    block += np.array(q_all, dtype=dtype)
+    if m:
+        block %= m
+    return block
+
+
+def _rows_to_array(np: Any, rows: List[List[int]], width: int) -> Any:
+    """Список строк -> 2-D массив; если числа не влезают в int64, беру dtype=object."""
+    try:
+        return np.array(rows, dtype=np.int64).reshape(len(rows), width)
+    except OverflowError:
+        block = np.empty((len(rows), width), dtype=object)
+        for i, row in enumerate(rows):
+            block[i, :] = row
+        return block
+
+
+# ---------------- Потоки для free-threaded CPython ----------------
+def gil_enabled() -> bool:
+    """
+    Включён ли GIL. sys._is_gil_enabled есть только с 3.13;
+    если его нет, GIL точно есть.
+    """
+    check = getattr(sys, "_is_gil_enabled", None)
+    return True if check is None else bool(check())
+
+
+def _expand_chunk(
+    current: List[int],
+    nxt: List[int],
+    lo: int,
+    hi: int,
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> None:
+    """Потомки узлов current[lo:hi] — сразу на их места в заранее выделенном nxt."""
+    part = current[lo:hi]
+    nxt[2 * lo:2 * hi:2] = [left_fn(v) for v in part]
+    nxt[2 * lo + 1:2 * hi:2] = [right_fn(v) for v in part]
+
+
+def build_tree_threaded(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    threads: Optional[int] = None,
+    min_chunk: int = 4096,
+    force: bool = False,
+) -> List[List[int]]:
+    """
+    Нерекурсивное построение, где каждый уровень считают несколько потоков:
+    уровень режется на threads кусков, и каждый поток пишет потомков своего
+    куска в свой срез заранее выделенного следующего уровня. В отличие от
+    build_tree_parallel нет ни запуска процессов, ни общей памяти, ни пиклинга.
+
+    Выигрыш будет только на free-threaded сборке (3.13t и новее). С обычным GIL
+    потоки всё равно идут по очереди, поэтому тогда просто вызываю
+    build_tree_iterative. force=True — всё равно через потоки (для замера).
+    Уровни короче 2 * min_chunk считаю в одном потоке: там пул только мешает.
+
+    Возвращает:
+        Список уровней, как build_tree_iterative.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if threads <= 1 or (gil_enabled() and not force):
+        return build_tree_iterative(data, left_fn, right_fn)
+
+    root: int = int(data["root"])
+    height: int = max(int(data["height"]), 1)
+    levels: List[List[int]] = [[root]]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        current = levels[0]
+        for _ in range(1, height):
+            n = len(current)
+            nxt: List[int] = [0] * (2 * n)
+            if n < 2 * min_chunk:
+                _expand_chunk(current, nxt, 0, n, left_fn, right_fn)
+            else:
+                parts = min(threads, n // min_chunk)
+                bounds = [n * i // parts for i in range(parts + 1)]
+                futures = [
+                    pool.submit(_expand_chunk, current, nxt, bounds[i], bounds[i + 1], left_fn, right_fn)
+                    for i in range(parts)
+                ]
+                for future in futures:
+                    future.result()
+            levels.append(nxt)
+            current = nxt
+    return levels
+
+
+# ---------------- Доступ к узлу без построения дерева ----------------
+def node_value(root: int, level: int, index: int, rule: AffineRule = VARIANT_14) -> int:
+    """
+    Значение узла (level, index) без построения дерева.
+
+    Путь от корня до узла записан в битах index (старший бит — первый шаг):
+    0 — идём влево (для варианта №14 это 3 - v), 1 — вправо (v * 2).
+    Поэтому достаточно пройти level шагов, то есть O(height) операций
+    вместо 2**height узлов. По умолчанию правила варианта №14,
+    но подходит любой AffineRule.
+
+    Нумерация как в списке уровней: levels[level][index],
+    где level = 0 — корень, а 0 <= index < 2**level.
+    """
+    if level < 0:
+        raise IndexError(f"уровень {level} вне дерева")
+    if not 0 <= index < (1 << level):
+        raise IndexError(f"индекс {index} вне уровня {level}")
+
+    a, b, c, d = rule.a, rule.b, rule.c, rule.d
+    # В модульном режиме корень тоже по модулю — как в CompiledRule.iter_levels.
+    v = root % rule.modulus if rule.modulus else root
+    for shift in range(level - 1, -1, -1):
+        if (index >> shift) & 1:
+            v = c * v + d
+        else:
+            v = a * v + b
+        if rule.modulus:
+            v %= rule.modulus
+    return v
+
+
+class LazyLevel:
+    """
+    Один уровень ленивого дерева. Значения не хранятся,
+    каждое считается через node_value при обращении.
+    Поддерживает level[i], отрицательные индексы и срезы.
+    """
+
+    def __init__(self, root: int, level: int, rule: AffineRule = VARIANT_14) -> None:
+        self.root = root
+        self.level = level
+        self.rule = rule
+
+    def __len__(self) -> int:
+        return 1 << self.level
+
+    def __getitem__(self, item):
+        size = 1 << self.level
+        if isinstance(item, slice):
+            # range сам разбирается с шагом и отрицательными границами,
+            # а len() тут не нужен, поэтому работает и для очень глубоких уровней.
+            return [node_value(self.root, self.level, i, self.rule) for i in range(size)[item]]
+        index = item + size if item < 0 else item
+        return node_value(self.root, self.level, index, self.rule)
+
+    def __iter__(self):
+        for i in range(1 << self.level):
+            yield node_value(self.root, self.level, i, self.rule)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyLevel):
+            return (self.root, self.level, self.rule) == (other.root, other.level, other.rule)
+        if isinstance(other, list):
+            return len(other) == len(self) and list(self) == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"LazyLevel(root={self.root}, level={self.level})"
+
+
+class LazyTree:
+    """
+    Ленивое представление дерева (по умолчанию вариант №14): tree[k][i] и tree[k][a:b]
+    работают как для списка уровней из build_tree_iterative, но ничего
+    заранее не строится. Удобно для запросов на высоте 40+,
+    где полный список уровней просто не поместится в память.
+    """
+
+    def __init__(self, root: int, height: int, rule: AffineRule = VARIANT_14) -> None:
+        self.root = int(root)
+        self.height = int(height)
+        self.rule = rule
+
+    def __len__(self) -> int:
+        return max(self.height, 1)
+
+    def __getitem__(self, level: int) -> LazyLevel:
+        n = len(self)
+        if level < 0:
+            level += n
+        if not 0 <= level < n:
+            raise IndexError(f"уровень {level} вне дерева высоты {self.height}")
+        return LazyLevel(self.root, level, self.rule)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield LazyLevel(self.root, k, self.rule)
+
+    def to_levels(self) -> List[List[int]]:
+        """Материализую дерево в обычный список уровней (только для маленьких высот)."""
+        return [list(level) for level in self]
+
+    def __repr__(self) -> str:
+        return f"LazyTree(root={self.root}, height={self.height})"
+
+
+# ---------------- Агрегаты по уровням без построения ----------------
+def _preimage_threshold(mul: int, add: int, t: int) -> Tuple[int, bool]:
+    """
+    Для ребра v -> mul * v + add переводит условие "потомок < t" в условие на родителя.
+    Возвращает (t', flip): при flip=False это "v < t'", при flip=True — "не (v < t')".
+    При mul == 0 потомок — константа add, тогда t' не нужен (флаг говорит, выполнено ли условие).
+    """
+    if mul > 0:
+        return -((add - t) // mul), False  # ceil((t - add) / mul)
+    if mul < 0:
+        return (t - add) // mul + 1, True
+    return 0, add < t
+
+
+def level_stats(
+    root: int,
+    height: int,
+    edges: Optional[List[int]] = None,
+    rule: AffineRule = VARIANT_14,
+) -> List[Dict[str, Any]]:
+    """
+    Агрегаты каждого уровня без построения дерева: count, sum, min, max,
+    negatives (сколько значений < 0) и, если заданы edges, histogram.
+
+    Всё считается по рекуррентным формулам над уровнями:
+      sum:      S[k+1] = (a + c) * S[k] + (b + d) * 2**k
+      min/max:  отображения монотонны, так что крайние значения уровня
+                получаются из крайних значений предыдущего;
+      "сколько значений < t": для каждого ребра условие на потомка
+                переводится в условие "< t'" на родителя, так что
+                C[k+1](t) выражается через C[k] в паре других порогов.
+    Пороги быстро сходятся к небольшому набору, поэтому работа
+    O(height * число порогов), а не O(2**height) — хоть высота 60.
+
+    histogram[i] — число значений в [edges[i-1], edges[i]),
+    первая и последняя корзины открыты (до edges[0] и от edges[-1]).
+    """
+    if rule.modulus:
+        raise ValueError("level_stats считает точные значения, модульное правило не подходит")
+    a, b, c, d = rule.a, rule.b, rule.c, rule.d
+    height = max(int(height), 1)
+    edges = sorted(edges) if edges else []
+
+    # Сверху вниз собираю, какие пороги понадобятся на каждом уровне.
+    needed: List[set] = [set() for _ in range(height)]
+    needed[-1] = {0, *edges}
+    for k in range(height - 1, 0, -1):
+        needed[k - 1].update((0, *edges))
+        for t in needed[k]:
+            for mul, add in ((a, b), (c, d)):
+                if mul != 0:
+                    needed[k - 1].add(_preimage_threshold(mul, add, t)[0])
+
+    stats: List[Dict[str, Any]] = []
+    below: Dict[int, int] = {t: int(root < t) for t in needed[0]}
+    total, low, high = root, root, root
+    for k in range(height):
+        count = 1 << k
+        if k > 0:
+            prev = below
+            below = {}
+            for t in needed[k]:
+                n = 0
+                for mul, add in ((a, b), (c, d)):
+                    t_parent, flip = _preimage_threshold(mul, add, t)
+                    if mul == 0:
+                        n += count // 2 if flip else 0
+                    elif flip:
+                        n += count // 2 - prev[t_parent]
+                    else:
+                        n += prev[t_parent]
+                below[t] = n
+        level: Dict[str, Any] = {
+            "level": k,
+            "count": count,
+            "sum": total,
+            "min": low,
+            "max": high,
+            "negatives": below[0],
+        }
+        if edges:
+            cuts = [0] + [below[e] for e in edges] + [count]
+            level["histogram"] = [cuts[i + 1] - cuts[i] for i in range(len(cuts) - 1)]
+        stats.append(level)
+
+        # Переход к следующему уровню для sum/min/max.
+        candidates = [mul * x + add for mul, add in ((a, b), (c, d)) for x in (low, high)]
+        total = (a + c) * total + (b + d) * count
+        low, high = min(candidates), max(candidates)
+    return stats
+
+
+def check_level_stats(
+    root: int,
+    height: int,
+    edges: Optional[List[int]] = None,
+    rule: AffineRule = VARIANT_14,
+) -> bool:
+    """Сверяю level_stats с честным подсчётом по build_tree_iterative (для маленьких высот)."""
+    edges = sorted(edges) if edges else []
+    levels = build_tree_iterative({"root": root, "height": height}, rule.left, rule.right)
+    for level, got in zip(levels, level_stats(root, height, edges, rule)):
+        expected: Dict[str, Any] = {
+            "level": got["level"],
+            "count": len(level),
+            "sum": sum(level),
+            "min": min(level),
+            "max": max(level),
+            "negatives": sum(1 for v in level if v < 0),
+        }
+        if edges:
+            bounds = [None] + edges + [None]
+            expected["histogram"] = [
+                sum(1 for v in level
+                    if (lo is None or v >= lo) and (hi is None or v < hi))
+                for lo, hi in zip(bounds, bounds[1:])
+            ]
+        if got != expected:
+            return False
+    return True
+
+
+# ---------------- Обратный поиск: где в дереве встречается значение ----------------
+def _parents(value: int, rule: AffineRule) -> List[Tuple[int, int]]:
+    """
+    Все возможные родители значения: пары (родитель, бит стороны),
+    0 — value левый потомок (a * p + b), 1 — правый (c * p + d).
+    Для варианта №14: p = 3 - value и p = value / 2 (если чётное).
+    """
+    result: List[Tuple[int, int]] = []
+    for bit, (mul, add) in enumerate(((rule.a, rule.b), (rule.c, rule.d))):
+        if mul == 0:
+            continue  # у константного ребра родитель любой — такие правила не поддерживаю
+        diff = value - add
+        if diff % mul == 0:
+            result.append((diff // mul, bit))
+    return result
+
+
+def find_positions(
+    root: int,
+    height: int,
+    value: int,
+    rule: AffineRule = VARIANT_14,
+) -> List[Tuple[int, int]]:
+    """
+    Все позиции (level, index) значения value в дереве высоты height,
+    отсортированные по уровню и индексу, без построения дерева.
+
+    Правила обратимы, поэтому иду от value вверх: на каждом шаге у значения
+    не больше двух кандидатов в родители. Чтобы не перебирать тупики
+    (а у варианта №14 их очень много: 3 - (3 - v) == v), запоминаю
+    для пары (значение, глубина), достижима ли она от корня.
+    Состояний при подъёме немного (значения вида ±value / 2**i плюс
+    небольшая константа), так что время — примерно height * число найденных позиций.
+    """
+    if any(mul == 0 for mul in (rule.a, rule.c)):
+        raise ValueError("обратный поиск нужен обратимым правилам (a != 0 и c != 0)")
+    if rule.modulus:
+        raise ValueError("обратный поиск работает только с точными (не модульными) правилами")
+    height = max(int(height), 1)
+    reachable: Dict[Tuple[int, int], bool] = {}
+
+    def is_reachable(v: int, depth: int) -> bool:
+        # Можно ли из корня за depth шагов попасть в значение v.
+        key = (v, depth)
+        known = reachable.get(key)
+        if known is None:
+            if depth == 0:
+                known = v == root
+            else:
+                known = any(is_reachable(p, depth - 1) for p, _ in _parents(v, rule))
+            reachable[key] = known
+        return known
+
+    def indices(v: int, depth: int) -> Iterator[int]:
+        # Индексы внутри уровня depth для всех путей от корня к v.
+        if depth == 0:
+            yield 0
+            return
+        for p, bit in _parents(v, rule):
+            if is_reachable(p, depth - 1):
+                for i in indices(p, depth - 1):
+                    yield 2 * i + bit
+
+    positions: List[Tuple[int, int]] = []
+    for level in range(height):
+        if is_reachable(value, level):
+            positions.extend((level, i) for i in sorted(indices(value, level)))
+    return positions
+
+
+def find_positions_by_scan(root: int, height: int, value: int) -> List[Tuple[int, int]]:
+    """То же самое простым способом: строю уровни и просматриваю их подряд."""
+    levels = build_tree_iterative({"root": root, "height": height},
+                                  left_child_variant_14, right_child_variant_14)
+    return [(k, i) for k, level in enumerate(levels) for i, v in enumerate(level) if v == value]
+
+
+# ---------------- Компактное хранение (плоская heap-раскладка) ----------------
+class FlatTree:
+    """
+    Дерево в одном непрерывном буфере array('q') в порядке кучи:
+    у узла i дети лежат в 2i+1 и 2i+2, а уровень k занимает
+    индексы [2**k - 1, 2**(k+1) - 1).
+
+    В List[List[int]] на каждый узел приходится отдельный объект int
+    (28+ байт) плюс 8 байт указателя в списке, а здесь ровно 8 байт на узел.
+    И сканировать такой буфер подряд гораздо приятнее для кэша процессора.
+
+    level(k) возвращает memoryview без копирования. Пока такие срезы живы,
+    буфер менять нельзя (array ругнётся BufferError) — но после
+    построения он и не меняется.
+
+    С обычным списком уровней дерево сравнивается через ==, так что
+    sanity_check_same_structure работает и с ним.
+    """
+
+    def __init__(self, buffer: array, height: int) -> None:
+        if len(buffer) != (1 << height) - 1:
+            raise ValueError(
+                f"в буфере {len(buffer)} узлов, а для высоты {height} нужно {(1 << height) - 1}"
+            )
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self.height = height
+
+    @classmethod
+    def from_levels(cls, levels: Iterable[List[int]], typecode: str = "q") -> "FlatTree":
+        """Складываю уровни подряд в один буфер (подходит и генератор iter_levels)."""
+        buffer = array(typecode)
+        height = 0
+        for level in levels:
+            try:
+                buffer.extend(level)
+            except OverflowError:
+                raise OverflowError(
+                    f"значения уровня {height} не помещаются в array('{typecode}')"
+                ) from None
+            height += 1
+        return cls(buffer, height)
+
+    @classmethod
+    def build(
+        cls,
+        data: Dict[str, Any],
+        left_fn: Callable[[int], int],
+        right_fn: Callable[[int], int],
+        typecode: str = "q",
+    ) -> "FlatTree":
+        """Строю сразу в плоский буфер, промежуточный список уровней не копится."""
+        return cls.from_levels(iter_levels(data, left_fn, right_fn), typecode)
+
+    @property
+    def nbytes(self) -> int:
+        return self._view.nbytes
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def __getitem__(self, index: int) -> int:
+        return self._buffer[index]
+
+    def level(self, k: int) -> memoryview:
+        """Уровень k как memoryview поверх буфера (без копирования)."""
+        if not 0 <= k < self.height:
+            raise IndexError(f"уровень {k} вне дерева высоты {self.height}")
+        return self._view[(1 << k) - 1:(1 << (k + 1)) - 1]
+
+    def children(self, index: int) -> Tuple[int, int]:
+        """Значения левого и правого потомков узла index."""
+        left = 2 * index + 1
+        if left + 1 >= len(self._buffer):
+            raise IndexError(f"у узла {index} нет потомков")
+        return self._buffer[left], self._buffer[left + 1]
+
+    def to_levels(self) -> List[List[int]]:
+        """Обратно в обычный список уровней."""
+        return [self.level(k).tolist() for k in range(self.height)]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, FlatTree):
+            return self.height == other.height and self._buffer == other._buffer
+        if isinstance(other, list):
+            if len(other) != self.height:
+                return False
+            return all(self.level(k).tolist() == other[k] for k in range(self.height))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"FlatTree(height={self.height}, nodes={len(self)}, typecode='{self._buffer.typecode}')"
+
+
+# ---------------- Дерево как DAG: общие поддеревья хранятся один раз ----------------
+class TreeDag:
+    """
+    Дерево, в котором одинаковые поддеревья склеены (hash-consing).
+    Поддерево полностью задаётся парой (значение в вершине, оставшаяся высота),
+    поэтому для каждой такой пары хранится ровно одна вершина.
+
+    У варианта №14 левое правило — инволюция (3 - (3 - v) == v),
+    так что одинаковых поддеревьев очень много: у меня на высоте 25
+    вышло около 0.5 млн уникальных поддеревьев вместо 33 млн узлов.
+
+    Вершины лежат в параллельных списках values/lefts/rights,
+    у листьев lefts[i] == rights[i] == -1.
+    """
+
+    def __init__(
+        self,
+        root_id: int,
+        height: int,
+        values: List[int],
+        lefts: List[int],
+        rights: List[int],
+        memo_hits: int,
+    ) -> None:
+        self.root_id = root_id
+        self.height = height
+        self.values = values
+        self.lefts = lefts
+        self.rights = rights
+        self.memo_hits = memo_hits
+
+    @property
+    def node_count(self) -> int:
+        """Сколько узлов было бы в обычном дереве."""
+        return (1 << self.height) - 1
+
+    @property
+    def unique_subtrees(self) -> int:
+        return len(self.values)
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика: узлы дерева vs уникальные поддеревья."""
+        return {
+            "height": self.height,
+            "nodes": self.node_count,
+            "unique_subtrees": self.unique_subtrees,
+            "memo_hits": self.memo_hits,
+            "compression": self.node_count / self.unique_subtrees,
+        }
+
+    def iter_levels(self) -> Iterator[List[int]]:
+        """Разворачиваю DAG обратно в уровни (по одному, как iter_levels)."""
+        ids: List[int] = [self.root_id]
+        for k in range(self.height):
+            yield [self.values[i] for i in ids]
+            if k == self.height - 1:
+                break
+            nxt: List[int] = []
+            for i in ids:
+                nxt.append(self.lefts[i])
+                nxt.append(self.rights[i])
+            ids = nxt
+
+    def to_levels(self) -> List[List[int]]:
+        """Обычный список уровней, как у build_tree_iterative."""
+        return list(self.iter_levels())
+
+    def __repr__(self) -> str:
+        return (f"TreeDag(height={self.height}, nodes={self.node_count}, "
+                f"unique_subtrees={self.unique_subtrees})")
+
+
+def build_tree_dag(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> TreeDag:
+    """
+    Строю дерево как DAG: поддерево с ключом (значение, оставшаяся высота)
+    строится один раз, дальше берётся из memo.
+
+    В отличие от lru_cache на left_fn/right_fn (экономит только 3 - v и v * 2),
+    здесь кэшируется сразу целое поддерево, поэтому работа пропорциональна
+    числу уникальных поддеревьев, а не 2**height.
+    """
+    root: int = int(data["root"])
+    height: int = max(int(data["height"]), 1)
+
+    memo: Dict[Tuple[int, int], int] = {}
+    values: List[int] = []
+    lefts: List[int] = []
+    rights: List[int] = []
+    hits = 0
+
+    # Обход в глубину с явным стеком (как build_node_tree), а не рекурсия:
+    # там, где значения не растут, DAG маленький, а высота может быть
+    # в тысячи уровней — больше sys.getrecursionlimit().
+    # (value, remaining, done): done=False — узел ещё не раскрыт,
+    # done=True — оба поддерева готовы, их id лежат на вершине ids.
+    ids: List[int] = []
+    stack: List[Tuple[int, int, bool]] = [(root, height, False)]
+    while stack:
+        value, remaining, done = stack.pop()
+        key = (value, remaining)
+        if done:
+            right_id = ids.pop()
+            left_id = ids.pop()
+        else:
+            node_id = memo.get(key)
+            if node_id is not None:
+                hits += 1
+                ids.append(node_id)
+                continue
+            if remaining > 1:
+                # Правое кладу раньше: левое поддерево строится первым, как в рекурсии.
+                stack.append((value, remaining, True))
+                stack.append((right_fn(value), remaining - 1, False))
+                stack.append((left_fn(value), remaining - 1, False))
+                continue
+            left_id = right_id = -1
+
+        node_id = len(values)
+        values.append(value)
+        lefts.append(left_id)
+        rights.append(right_id)
+        memo[key] = node_id
+        ids.append(node_id)
+
+    return TreeDag(ids[0], height, values, lefts, rights, hits)
+
+
+# ---------------- Связное дерево из объектов Node ----------------
+class Node:
+    """
+    Узел настоящего связного дерева: значение, два потомка и родитель.
+
+    __slots__ убирает у каждого объекта собственный __dict__. У меня
+    (CPython 3.11, tracemalloc) узел занимает 64 байта, обычный класс с теми же
+    полями — около 104, а словарь {"value": ..., "left": ..., ...} — около 184.
+    Плюс сам int значения, он одинаковый во всех трёх случаях.
+    """
+
+    __slots__ = ("value", "left", "right", "parent")
+
+    def __init__(self, value: int, parent: Optional["Node"] = None) -> None:
+        self.value = value
+        self.left: Optional[Node] = None
+        self.right: Optional[Node] = None
+        self.parent = parent
+
+    def is_leaf(self) -> bool:
+        return self.left is None
+
+    def __repr__(self) -> str:
+        return f"Node({self.value})"
+
+
+def build_node_tree(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> Node:
+    """
+    Строю связное дерево обходом в глубину с явным стеком вместо рекурсии,
+    поэтому высота не упирается в sys.getrecursionlimit().
+    В стеке лежат пары (узел, его уровень). Правого потомка кладу первым,
+    чтобы левое поддерево строилось раньше (обычный прямой порядок).
+
+    Возвращает корень; уровни из него достаёт node_tree_to_levels.
+    """
+    height: int = max(int(data["height"]), 1)
+    root = Node(int(data["root"]))
+    last = height - 1
+    stack: List[Tuple[Node, int]] = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if depth == last:
+            continue
+        left = node.left = Node(left_fn(node.value), node)
+        right = node.right = Node(right_fn(node.value), node)
+        stack.append((right, depth + 1))
+        stack.append((left, depth + 1))
+    return root
+
+
+def node_tree_to_levels(root: Node) -> List[List[int]]:
+    """Связное дерево -> список уровней (обход в ширину)."""
+    levels: List[List[int]] = []
+    current: List[Node] = [root]
+    while current:
+        levels.append([node.value for node in current])
+        nxt: List[Node] = []
+        for node in current:
+            if node.left is not None:
+                nxt.append(node.left)
+            if node.right is not None:
+                nxt.append(node.right)
+        current = nxt
+    return levels
+
+
+def node_tree_from_levels(levels: List[List[int]]) -> Node:
+    """
+    Список уровней (полное дерево, как у build_tree_iterative) -> связное дерево.
+    Узел j уровня k — родитель узлов 2j и 2j+1 уровня k+1.
+    """
+    if not levels or len(levels[0]) != 1:
+        raise ValueError("на первом уровне должен быть ровно один корень")
+    current: List[Node] = [Node(levels[0][0])]
+    root = current[0]
+    for k in range(1, len(levels)):
+        level = levels[k]
+        if len(level) != 2 * len(current):
+            raise ValueError(
+                f"на уровне {k} {len(level)} значений, а должно быть {2 * len(current)}"
+            )
+        nxt: List[Node] = []
+        for j, parent in enumerate(current):
+            parent.left = Node(level[2 * j], parent)
+            parent.right = Node(level[2 * j + 1], parent)
+            nxt.append(parent.left)
+            nxt.append(parent.right)
+        current = nxt
+    return root
+
+
+# ---------------- Утилиты: бенчмарк, CSV, графики ----------------
+def time_function(fn: Callable[[], None], repeat: int = 7, number: int = 1) -> float:
+    """
+    Маленькая обёртка для timeit: беру минимум из нескольких прогона.
+    Мне так проще получать стабильные цифры.
+    """
+    return min(timeit.repeat(fn, repeat=repeat, number=number))
+
+
+def benchmark_by_heights(
+    builder_a: Callable[[Dict[str, Any], Callable[[int], int], Callable[[int], int]], List[List[int]]],
+    builder_b: Callable[[Dict[str, Any], Callable[[int], int], Callable[[int], int]], List[List[int]]],
+    left_a: Callable[[int], int], right_a: Callable[[int], int],
+    left_b: Callable[[int], int], right_b: Callable[[int], int],
+    root: int,
+    heights: List[int],
+    repeat: int = 7,
+    number: int = 1,
+) -> List[Tuple[int, float, float]]:
+    """
+    Замер времени двух "реализаций" (builder_a vs builder_b) на наборах высот.
+
+    Я сделал универсально: можно подставить:
+      - рекурсивный/итеративный
+      - кэш/без кэша
+    """
+    rows: List[Tuple[int, float, float]] = []
+    for h in heights:
+        data = {"root": root, "height": h}
+
+        def run_a():
+            builder_a(data, left_a, right_a)
+
+        def run_b():
+            builder_b(data, left_b, right_b)
+
+        t_a = time_function(run_a, repeat=repeat, number=number)
+        t_b = time_function(run_b, repeat=repeat, number=number)
+        rows.append((h, t_a, t_b))
+    return rows
+
+
+def benchmark_cold_warm(
+    builder: Callable[..., List[List[int]]],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    cache: ChildCache,
+    root: int,
+    heights: List[int],
+    repeat: int = 7,
+) -> List[Tuple[int, float, float]]:
+    """
+    Холодный vs тёплый кэш для построителя с параметром cache=
+    (build_tree_recursive / build_tree_iterative).
+
+    Холодный: перед каждым замером cache.reset() (через setup у timeit,
+    так что сам сброс во время не попадает). Тёплый: один прогон для
+    прогрева, дальше меряю как обычно. Возвращает (height, cold, warm) —
+    в том же виде, что benchmark_by_heights, чтобы годились save_csv и plot_two_series.
+    """
+    rows: List[Tuple[int, float, float]] = []
+    for h in heights:
+        data = {"root": root, "height": h}
+
+        def run() -> None:
+            builder(data, left_fn, right_fn, cache=cache)
+
+        t_cold = min(timeit.repeat(run, setup=cache.reset, repeat=repeat, number=1))
+        cache.reset()
+        run()
+        t_warm = time_function(run, repeat=repeat, number=1)
+        rows.append((h, t_cold, t_warm))
+    return rows
+
+
+def benchmark_sweep(
+    root: int,
+    heights: List[int],
+    repeat: int = 5,
+) -> List[Tuple[int, float, float]]:
+    """
+    Сколько стоит проход по высотам heights[0]..N для каждого N:
+    A — каждый раз заново через build_tree_iterative,
+    B — один TreeBuilder с extend_to (sweep_heights).
+    """
+    rows: List[Tuple[int, float, float]] = []
+    for n in range(1, len(heights) + 1):
+        prefix = heights[:n]
+
+        def run_rebuild() -> None:
+            for h in prefix:
+                build_tree_iterative({"root": root, "height": h},
+                                     left_child_variant_14, right_child_variant_14)
+
+        def run_incremental() -> None:
+            for _ in sweep_heights(root, prefix):
+                pass
+
+        t_rebuild = time_function(run_rebuild, repeat=repeat, number=1)
+        t_incremental = time_function(run_incremental, repeat=repeat, number=1)
+        rows.append((prefix[-1], t_rebuild, t_incremental))
+    return rows
+
+
+def benchmark_find_positions(
+    root: int,
+    heights: List[int],
+    value: int,
+    repeat: int = 5,
+) -> List[Tuple[int, float, float]]:
+    """Поиск позиций значения: просмотр уровней build_tree_iterative (A) vs find_positions (B)."""
+    rows: List[Tuple[int, float, float]] = []
+    for h in heights:
+        t_scan = time_function(lambda: find_positions_by_scan(root, h, value), repeat=repeat)
+        t_search = time_function(lambda: find_positions(root, h, value), repeat=repeat)
+        rows.append((h, t_scan, t_search))
+    return rows
+
+
+def benchmark_batch(
+    roots: Sequence[int],
+    heights: List[int],
+    repeat: int = 5,
+) -> List[Tuple[int, float, float]]:
+    """Деревья для многих корней: цикл build_tree_iterative по корням (A) vs build_tree_batch (B)."""
+    rows: List[Tuple[int, float, float]] = []
+    for h in heights:
+
+        def run_loop() -> None:
+            for root in roots:
+                build_tree_iterative({"root": root, "height": h},
+                                     left_child_variant_14, right_child_variant_14)
+
+        t_loop = time_function(run_loop, repeat=repeat)
+        t_batch = time_function(lambda: build_tree_batch(roots, h), repeat=repeat)
+        rows.append((h, t_loop, t_batch))
+    return rows
+
+
+def benchmark_thread_scaling(
+    root: int,
+    height: int,
+    thread_counts: List[int],
+    repeat: int = 5,
+) -> List[Tuple[int, float, float]]:
+    """
+    Кривая масштабирования по числу потоков на одной высоте:
+    A — build_tree_iterative (одинаковое для всех строк, для сравнения),
+    B — build_tree_threaded(threads=n, force=True), т.е. через потоки даже при GIL.
+    """
+    data = {"root": root, "height": height}
+    t_serial = time_function(
+        lambda: build_tree_iterative(data, left_child_variant_14, right_child_variant_14),
+        repeat=repeat,
+    )
+    rows: List[Tuple[int, float, float]] = []
+    for n in thread_counts:
+        t_threaded = time_function(
+            lambda: build_tree_threaded(data, left_child_variant_14, right_child_variant_14,
+                                        threads=n, force=True),
+            repeat=repeat,
+        )
+        rows.append((n, t_serial, t_threaded))
+    return rows
+
+
+def clear_legacy_caches() -> None:
+    """Сбрасываю глобальные lru_cache варианта №14, чтобы эксперименты не делили тёплый кэш."""
+    left_child_variant_14_cached.cache_clear()
+    right_child_variant_14_cached.cache_clear()
+
+
+Builder = Callable[[Dict[str, Any], Callable[[int], int], Callable[[int], int]], Any]
+
+
+def result_max_bit_length(result: Any) -> int:
+    """
+    Длина в битах самого большого по модулю значения нижнего уровня.
+    Понимает список уровней, FlatTree и корень связного дерева Node.
+    Нужна, чтобы рост big int был отдельным измерением в замерах.
+    """
+    if isinstance(result, FlatTree):
+        last = result.level(result.height - 1).tolist()
+    elif isinstance(result, Node):
+        last = node_tree_to_levels(result)[-1]
+    else:
+        last = result[-1]
+    return max(abs(min(last)), abs(max(last))).bit_length()
+
+
+def benchmark_bigint_growth(
+    height: int,
+    bit_lengths: List[int],
+    repeat: int = 7,
+    number: int = 1,
+) -> List[Tuple[int, float, float]]:
+    """
+    Рост big int как отдельное измерение: дерево фиксированной высоты,
+    а корень всё длиннее (bit_lengths бит). A — точные значения,
+    B — то же самое по модулю 2**64 (modular_children).
+    Возвращает (bits, A, B) — для plot_two_series с xlabel="root bits".
+    """
+    left_mod, right_mod = modular_children(left_child_variant_14, right_child_variant_14, MOD64)
+    rows: List[Tuple[int, float, float]] = []
+    for bits in bit_lengths:
+        root = (1 << (bits - 1)) | 14
+        exact = {"root": root, "height": height}
+        modular = {"root": root % MOD64, "height": height}
+        t_exact = time_function(
+            lambda: build_tree_iterative(exact, left_child_variant_14, right_child_variant_14),
+            repeat=repeat, number=number)
+        t_mod = time_function(
+            lambda: build_tree_iterative(modular, left_mod, right_mod),
+            repeat=repeat, number=number)
+        rows.append((bits, t_exact, t_mod))
+    return rows
+
+
+def calibrate_number(fn: Callable[[], None], budget: float) -> int:
+    """
+    Подбираю number для timeit так, чтобы один замер занимал около budget секунд.
+    Сначала, как timeit.autorange, удваиваю number, пока замер не станет
+    хотя бы в 1 мс (иначе слишком шумно), потом пересчитываю под бюджет.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= 1e-3 or number >= 1 << 20:
+            break
+        number *= 2
+    per_call = elapsed / number
+    return max(1, int(budget / per_call)) if per_call > 0 else number
+
+
+def measure_memory(
+    builder: Builder,
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> Dict[str, int]:
+    """
+    Память одного построения через tracemalloc:
+      peak_bytes     — пик во время построения;
+      result_bytes   — сколько занимает готовый результат;
+      blocks         — сколько выделенных блоков живо сразу после построения;
+      retained_bytes — что осталось после удаления результата
+                       (например, записи в lru_cache, которые никто не чистит).
+    Кэши lru_cache у left_fn/right_fn перед замером сбрасываю,
+    чтобы каждый замер начинался с холодного кэша.
+    """
+    for fn in (left_fn, right_fn):
+        cache_clear = getattr(fn, "cache_clear", None)
+        if cache_clear is not None:
+            cache_clear()
+    gc.collect()
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        result = builder(data, left_fn, right_fn)
+        current, peak = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        del result
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return {
+        "peak_bytes": peak - before,
+        "result_bytes": current - before,
+        "blocks": blocks,
+        "retained_bytes": after - before,
+    }
+
+
+def measure_import_time(module: str = "binary_tree_step3", repeat: int = 5) -> Dict[str, Any]:
+    """
+    Время импорта модуля в свежем интерпретаторе (python -X importtime).
+    Беру минимум cumulative по repeat запускам, в микросекундах,
+    и для сравнения — время всего процесса минус пустой "python -c pass".
+    """
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    import_us: List[int] = []
+    process_s: List[float] = []
+    empty_s: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True, cwd=here)
+        empty_s.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        done = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            check=True, cwd=here, capture_output=True, text=True,
+        )
+        process_s.append(time.perf_counter() - start)
+        for line in done.stderr.splitlines():
+            # "import time:  self [us] | cumulative | imported package"
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                import_us.append(int(parts[1]))
+    return {
+        "module": module,
+        "import_us": min(import_us) if import_us else None,
+        "process_overhead_s": min(process_s) - min(empty_s),
+    }
+
+
+class BenchmarkSuite:
+    """
+    Набор построителей, которые меряются одинаково.
+
+    В отличие от benchmark_by_heights (две функции и фиксированный number)
+    здесь построители регистрируются по имени, number подбирается на каждой
+    высоте под бюджет времени, а в результат идут min/медиана/IQR
+    и наносекунды на узел. Результаты можно сохранить в JSON.
+    """
+
+    def __init__(self) -> None:
+        self._builders: Dict[str, Tuple[Builder, Callable[[int], int], Callable[[int], int]]] = {}
+        self.results: List[Dict[str, Any]] = []
+        self.memory_results: List[Dict[str, Any]] = []
+        self.import_results: List[Dict[str, Any]] = []
+
+    def register(
+        self,
+        name: str,
+        builder: Builder,
+        left_fn: Callable[[int], int],
+        right_fn: Callable[[int], int],
+    ) -> None:
+        if name in self._builders:
+            raise ValueError(f"построитель {name!r} уже зарегистрирован")
+        self._builders[name] = (builder, left_fn, right_fn)
+
+    def names(self) -> List[str]:
+        return list(self._builders)
+
+    def run(
+        self,
+        root: int,
+        heights: List[int],
+        budget: float = 0.05,
+        repeat: int = 9,
+        names: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Меряю каждый построитель на каждой высоте.
+        budget — примерное время одного замера (секунд), всего замеров repeat.
+        Все времена в результате — на один вызов построителя.
+        """
+        import statistics
+
+        if repeat < 2:
+            raise ValueError("для медианы и IQR нужно repeat >= 2")
+        rows: List[Dict[str, Any]] = []
+        for name in names or self.names():
+            builder, left_fn, right_fn = self._builders[name]
+            for h in heights:
+                data = {"root": root, "height": h}
+
+                def run_once() -> None:
+                    builder(data, left_fn, right_fn)
+
+                number = calibrate_number(run_once, budget)
+                samples = [t / number for t in timeit.repeat(run_once, repeat=repeat, number=number)]
+                q1, median, q3 = statistics.quantiles(samples, n=4)
+                max_bits = result_max_bit_length(builder(data, left_fn, right_fn))
+                nodes = (1 << max(h, 1)) - 1
+                rows.append({
+                    "builder": name,
+                    "height": h,
+                    "nodes": nodes,
+                    "number": number,
+                    "repeat": repeat,
+                    "min": min(samples),
+                    "median": median,
+                    "iqr": q3 - q1,
+                    "ns_per_node": median / nodes * 1e9,
+                    "max_bit_length": max_bits,
+                })
+        self.results.extend(rows)
+        return rows
+
+    def run_memory(
+        self,
+        root: int,
+        heights: List[int],
+        names: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Режим памяти: для каждого построителя и высоты — пик tracemalloc,
+        число живых блоков и байты на узел (см. measure_memory).
+        """
+        rows: List[Dict[str, Any]] = []
+        for name in names or self.names():
+            builder, left_fn, right_fn = self._builders[name]
+            for h in heights:
+                stats = measure_memory(builder, {"root": root, "height": h}, left_fn, right_fn)
+                nodes = (1 << max(h, 1)) - 1
+                rows.append({
+                    "builder": name,
+                    "height": h,
+                    "nodes": nodes,
+                    **stats,
+                    "bytes_per_node": stats["peak_bytes"] / nodes,
+                })
+        self.memory_results.extend(rows)
+        return rows
+
+    def run_import_time(self, modules: Iterable[str] = ("binary_tree_step3",), repeat: int = 5) -> List[Dict[str, Any]]:
+        """Время импорта модулей — тоже часть замеров, пакетные задачи платят его каждый раз."""
+        rows = [measure_import_time(module, repeat) for module in modules]
+        self.import_results.extend(rows)
+        return rows
+
+    def save_json(self, path: str) -> None:
+        """Сохраняю все накопленные результаты в JSON (рядом с CSV/PNG)."""
+        payload = {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "results": self.results,
+            "memory": self.memory_results,
+            "import": self.import_results,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def default_suite() -> BenchmarkSuite:
+    """Все построители из этого файла, зарегистрированные под понятными именами."""
+    suite = BenchmarkSuite()
+    suite.register("recursive_nc", build_tree_recursive, left_child_variant_14, right_child_variant_14)
+    suite.register("iterative_nc", build_tree_iterative, left_child_variant_14, right_child_variant_14)
+    suite.register("recursive_cached", build_tree_recursive,
+                   left_child_variant_14_cached, right_child_variant_14_cached)
+    suite.register("iterative_cached", build_tree_iterative,
+                   left_child_variant_14_cached, right_child_variant_14_cached)
+    suite.register("numpy", build_tree_numpy, left_child_variant_14, right_child_variant_14)
+    suite.register("compiled", build_tree_compiled, VARIANT_14.left, VARIANT_14.right)
+    suite.register("flat", FlatTree.build, left_child_variant_14, right_child_variant_14)
+    suite.register("node_tree", build_node_tree, left_child_variant_14, right_child_variant_14)
+    left_mod, right_mod = modular_children(left_child_variant_14, right_child_variant_14, MOD64)
+    suite.register("iterative_mod64", build_tree_iterative, left_mod, right_mod)
+    suite.register("compiled_mod64", build_tree_compiled, left_mod, right_mod)
+    return suite
+
+
+_MEMORY_FIELDS = ["builder", "height", "nodes", "peak_bytes", "result_bytes",
+                  "blocks", "retained_bytes", "bytes_per_node"]
+
+
+def save_memory_csv(rows: List[Dict[str, Any]], path: str) -> None:
+    """CSV для режима памяти: одна строка на построитель и высоту."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=_MEMORY_FIELDS)
+        w.writeheader()
+        for row in rows:
+            w.writerow({**row, "bytes_per_node": f"{row['bytes_per_node']:.2f}"})
+
+
+def pair_series(
+    rows: List[Dict[str, Any]],
+    name_a: str,
+    name_b: str,
+    field: str,
+) -> List[Tuple[int, float, float]]:
+    """
+    Достаю из строк BenchmarkSuite два ряда (height, A, B) по полю field,
+    чтобы нарисовать их тем же plot_two_series, что и графики времени.
+    """
+    by_key = {(r["builder"], r["height"]): r[field] for r in rows}
+    heights = sorted({r["height"] for r in rows if r["builder"] == name_a})
+    return [(h, by_key[(name_a, h)], by_key[(name_b, h)])
+            for h in heights if (name_b, h) in by_key]
+
+
+def save_csv(
+    rows: List[Tuple[int, float, float]],
+    path: str,
+    header_a: str,
+    header_b: str,
+    first_header: str = "height",
+) -> None:
+    """
+    Сохраняю результаты в CSV: height, A, B.
+    (Мне так удобнее потом вклеивать в отчёт.)
+    first_header — подпись первого столбца, если по X не высота (например, threads).
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow([first_header, header_a, header_b])
+        for h, a, b in rows:
+            w.writerow([h, f"{a:.8f}", f"{b:.8f}"])
+
+
+def load_csv(path: str) -> Tuple[List[Tuple[int, float, float]], str, str]:
+    """
+    Обратная к save_csv: читаю (height, A, B) и заголовки A/B.
+    Нужна, чтобы перерисовать графики без повторных замеров.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        r = csv.reader(f)
+        _, header_a, header_b = next(r)
+        rows = [(int(h), float(a), float(b)) for h, a, b in r]
+    return rows, header_a, header_b
+
+
+def plot_two_series(
+    rows: List[Tuple[int, float, float]],
+    label_a: str,
+    label_b: str,
+    title: str,
+    path: str,
+    ylabel: str = "seconds",
+    xlabel: str = "height",
+) -> None:
+    """
+    Рисую один график с двумя линиями.
+    По оси X — высота дерева, по оси Y — секунды
+    (или то, что передано в ylabel/xlabel, например байты на узел).
+    """
+    heights = [r[0] for r in rows]
+    series_a = [r[1] for r in rows]
+    series_b = [r[2] for r in rows]
+
+    plt = _pyplot()
+    plt.figure()
+    plt.plot(heights, series_a, marker="o", label=label_a)
+    plt.plot(heights, series_b, marker="o", label=label_b)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(path, dpi=120)
+    # Если нужно окно — раскомментируйте:
+    # plt.show()
+    plt.close()
+
+
+def sanity_check_same_structure() -> None:
+    """
+    Я на всякий случай проверяю, что базовые версии дают одинаковые уровни.
+    Это не строгий тест, просто чтобы самому убедиться.
+    """
+    data = {"root": 14, "height": 4}
+    base_rec = build_tree_recursive(data, left_child_variant_14, right_child_variant_14)
+    base_it = build_tree_iterative(data, left_child_variant_14, right_child_variant_14)
+    print("Совпадают ли уровни (recursive vs iterative, без кэша) при height=4? ->",
+          "Да" if base_rec == base_it else "Нет")
+    base_np = build_tree_numpy(data, left_child_variant_14, right_child_variant_14)
+    print("Совпадают ли уровни (iterative vs numpy) при height=4? ->",
+          "Да" if base_np == base_it else "Нет")
+    lazy = LazyTree(data["root"], data["height"]).to_levels()
+    print("Совпадают ли уровни (iterative vs LazyTree) при height=4? ->",
+          "Да" if lazy == base_it else "Нет")
+    flat = FlatTree.build(data, left_child_variant_14, right_child_variant_14)
+    print("Совпадают ли уровни (iterative vs FlatTree) при height=4? ->",
+          "Да" if flat == base_it else "Нет")
+    print("Совпадают ли агрегаты level_stats с подсчётом по уровням (height=12)? ->",
+          "Да" if check_level_stats(data["root"], 12, [-100, 0, 3, 100]) else "Нет")
+    dag = build_tree_dag(data, left_child_variant_14, right_child_variant_14)
+    print("Совпадают ли уровни (iterative vs DAG) при height=4? ->",
+          "Да" if dag.to_levels() == base_it else "Нет")
+    nodes = build_node_tree(data, left_child_variant_14, right_child_variant_14)
+    print("Совпадают ли уровни (iterative vs Node tree) при height=4? ->",
+          "Да" if node_tree_to_levels(nodes) == base_it else "Нет")
+
+
+# ---------------- Единая точка входа: выбор построителя по модели стоимости ----------------
+class BudgetExceededError(RuntimeError):
+    """Оценка времени или памяти построения больше бюджета, который задал вызывающий."""
+
+
+class Strategy(NamedTuple):
+    """
+    Построитель для build_tree. needs_rule=True — стратегия выигрывает только
+    на узнаваемом аффинном правиле (rule_from_callables), а произвольные
+    функции может и не принять (numpy передаёт в них целые массивы).
+    """
+
+    name: str
+    builder: Builder
+    needs_rule: bool = False
+
+
+_STRATEGIES: Dict[str, Strategy] = {}
+
+
+def register_strategy(name: str, builder: Builder, needs_rule: bool = False) -> None:
+    """Добавляю построитель в выбор build_tree (и в калибровку модели стоимости)."""
+    if name in _STRATEGIES:
+        raise ValueError(f"стратегия {name!r} уже зарегистрирована")
+    _STRATEGIES[name] = Strategy(name, builder, needs_rule)
+
+
+def strategies() -> List[str]:
+    return list(_STRATEGIES)
+
+
+def _build_iterative_cached(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+) -> List[List[int]]:
+    """Нерекурсивный с подключаемым LRU-кэшем потомков (свежий кэш на каждое построение)."""
+    return build_tree_iterative(data, left_fn, right_fn, cache=make_cache("lru", 4096))
+
+
+register_strategy("iterative", build_tree_iterative)
+register_strategy("recursive", build_tree_recursive)
+register_strategy("cached", _build_iterative_cached)
+register_strategy("numpy", build_tree_numpy, needs_rule=True)
+register_strategy("compiled", build_tree_compiled, needs_rule=True)
+register_strategy("threaded", build_tree_threaded)
+
+# Какие имена из BenchmarkSuite и exp*.csv соответствуют стратегиям.
+# iterative_cached сюда не входит: там глобальный lru_cache, тёплый между
+# повторами замера, а стратегия cached начинает каждое построение с пустого кэша.
+_BENCH_TO_STRATEGY = {
+    "iterative_nc": "iterative",
+    "recursive_nc": "recursive",
+    "numpy": "numpy",
+    "compiled": "compiled",
+}
+
+# Результат в виде списков уровней: int (28+ байт) плюс указатель в списке.
+# У меня measure_memory даёт 35–37 байт на узел на высотах 10–14.
+_DEFAULT_BYTES_PER_NODE = 40.0
+
+
+def _fit_linear(samples: List[Tuple[int, float]]) -> Tuple[float, float]:
+    """
+    Подгоняю t = a * nodes + b по точкам (nodes, секунды).
+    Взвешиваю 1 / t**2, т.е. минимизирую относительную ошибку: иначе
+    большие высоты задавят маленькие, а выбор как раз на маленьких и важен.
+    """
+    if not samples:
+        raise ValueError("нет точек для подгонки")
+    weights = [1.0 / max(t, 1e-12) ** 2 for _, t in samples]
+    sw = sum(weights)
+    sx = sum(w * n for w, (n, _) in zip(weights, samples))
+    sy = sum(w * t for w, (_, t) in zip(weights, samples))
+    sxx = sum(w * n * n for w, (n, _) in zip(weights, samples))
+    sxy = sum(w * n * t for w, (n, t) in zip(weights, samples))
+    det = sw * sxx - sx * sx
+    if det <= 0:
+        # Одна высота: считаю, что время пропорционально числу узлов.
+        return sy / sx, 0.0
+    a = (sw * sxy - sx * sy) / det
+    b = (sy - a * sx) / sw
+    if b < 0 or a < 0:
+        # Отрицательная "стоимость вызова" — шум; оставляю чистую пропорциональность.
+        return sxy / sxx, 0.0
+    return a, b
+
+
+class CostModel:
+    """
+    Модель стоимости построителей: время t ≈ a * nodes + b (секунды)
+    и память ≈ bytes_per_node * nodes для каждой стратегии.
+
+    Коэффициенты берутся из сохранённых замеров (from_benchmark_json,
+    from_csv_baselines) или меряются заново на этой машине (recalibrate).
+    """
+
+    def __init__(self) -> None:
+        self.coefficients: Dict[str, Tuple[float, float]] = {}
+        self.bytes_per_node: Dict[str, float] = {}
+        self.source: Dict[str, str] = {}
+
+    def fit(self, name: str, samples: List[Tuple[int, float]], source: str = "fit") -> None:
+        self.coefficients[name] = _fit_linear(samples)
+        self.source[name] = source
+
+    def names(self) -> List[str]:
+        return list(self.coefficients)
+
+    def predict_time(self, name: str, nodes: int) -> Optional[float]:
+        """Оценка времени (секунды) или None, если для стратегии нет данных."""
+        if name not in self.coefficients:
+            return None
+        a, b = self.coefficients[name]
+        return a * nodes + b
+
+    def predict_memory(self, name: str, nodes: int) -> float:
+        return self.bytes_per_node.get(name, _DEFAULT_BYTES_PER_NODE) * nodes
+
+    @classmethod
+    def from_benchmark_json(cls, path: str) -> "CostModel":
+        """Модель по bench_results.json (BenchmarkSuite.save_json): медианы и пик памяти."""
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        model = cls()
+        samples: Dict[str, List[Tuple[int, float]]] = {}
+        for row in payload.get("results", []):
+            name = _BENCH_TO_STRATEGY.get(row["builder"])
+            if name is not None:
+                samples.setdefault(name, []).append((row["nodes"], row["median"]))
+        for name, points in samples.items():
+            model.fit(name, points, source=os.path.basename(path))
+        for row in payload.get("memory", []):
+            name = _BENCH_TO_STRATEGY.get(row["builder"])
+            if name is not None:
+                model.bytes_per_node[name] = max(model.bytes_per_node.get(name, 0.0),
+                                                 row["peak_bytes"] / row["nodes"])
+        return model
+
+    @classmethod
+    def from_csv_baselines(cls, directory: str = ".", number: int = 50) -> "CostModel":
+        """
+        Модель по exp*.csv из EXPERIMENTS (там время number вызовов, как в run_benchmarks).
+        Для стратегии беру точки из всех экспериментов, где она встречается.
+        """
+        model = cls()
+        samples: Dict[str, List[Tuple[int, float]]] = {}
+        for spec in EXPERIMENTS:
+            path = os.path.join(directory, f"{spec.name}.csv")
+            if not os.path.exists(path):
+                continue
+            rows, header_a, header_b = load_csv(path)
+            for column, header in ((1, header_a), (2, header_b)):
+                name = _BENCH_TO_STRATEGY.get(header)
+                if name is None:
+                    continue
+                samples.setdefault(name, []).extend(
+                    ((1 << row[0]) - 1, row[column] / number) for row in rows
+                )
+        for name, points in samples.items():
+            model.fit(name, points, source="exp*.csv")
+        return model
+
+    def recalibrate(
+        self,
+        names: Optional[List[str]] = None,
+        root: int = 14,
+        heights: Sequence[int] = (6, 9, 12),
+        budget: float = 0.02,
+        repeat: int = 3,
+    ) -> "CostModel":
+        """
+        Перемеряю стратегии на этой машине (правила варианта №14)
+        и заменяю их коэффициенты. По умолчанию — все зарегистрированные.
+        """
+        for name in names or strategies():
+            strategy = _STRATEGIES[name]
+            points: List[Tuple[int, float]] = []
+            for h in heights:
+                data = {"root": root, "height": h}
+
+                def run_once() -> None:
+                    strategy.builder(data, left_child_variant_14, right_child_variant_14)
+
+                number = calibrate_number(run_once, budget)
+                points.append(((1 << h) - 1, time_function(run_once, repeat=repeat, number=number) / number))
+            self.fit(name, points, source="recalibrate")
+        return self
+
+    def save_json(self, path: str) -> None:
+        payload = {
+            "coefficients": {name: list(ab) for name, ab in self.coefficients.items()},
+            "bytes_per_node": self.bytes_per_node,
+            "source": self.source,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load_json(cls, path: str) -> "CostModel":
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        model = cls()
+        model.coefficients = {name: (a, b) for name, (a, b) in payload["coefficients"].items()}
+        model.bytes_per_node = dict(payload.get("bytes_per_node", {}))
+        model.source = dict(payload.get("source", {}))
+        return model
+
+    def __repr__(self) -> str:
+        return f"CostModel({', '.join(f'{n}: {self.source.get(n)}' for n in self.coefficients)})"
+
+
+COST_MODEL_FILE = "cost_model.json"
+_default_model: Optional[CostModel] = None
+
+
+def _module_path(name: str) -> str:
+    """Путь к файлу рядом с этим модулем (модель ищется там, а не в текущей папке)."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+# Априорные коэффициенты (a в с/узел, b в с) — мой calibrate на CPython 3.11,
+# правила варианта №14. Нужны только для стратегий, по которым нет файлов
+# с замерами; перемерить их на своей машине — команда calibrate.
+# У threaded априорной оценки нет: его скорость целиком зависит от того,
+# есть ли GIL, так что он участвует в выборе только после calibrate.
+_PRIOR_COEFFICIENTS: Dict[str, Tuple[float, float]] = {
+    "iterative": (92e-9, 2e-6),
+    "recursive": (93e-9, 7e-6),
+    "cached": (956e-9, 12e-6),
+    "numpy": (45e-9, 71e-6),
+    "compiled": (63e-9, 6e-6),
+}
+
+
+def default_cost_model() -> CostModel:
+    """
+    Модель по умолчанию (одна на процесс). Ищу рядом с этим файлом, по порядку:
+    cost_model.json (сохранённая калибровка), bench_results.json, exp*.csv.
+
+    Сам ничего не меряю: первый вызов build_tree в коротком процессе
+    не должен превращаться в бенчмарк. Стратегиям без данных беру
+    _PRIOR_COEFFICIENTS, приведённые к скорости машины из файлов
+    (по отношению времён iterative). Стратегии, зарегистрированные
+    через register_strategy, без данных в выборе не участвуют, пока
+    их не перемеряет calibrate (он и сохраняет cost_model.json).
+    """
+    global _default_model
+    if _default_model is None:
+        model = CostModel()
+        for path, loader in (
+            (_module_path(COST_MODEL_FILE), CostModel.load_json),
+            (_module_path("bench_results.json"), CostModel.from_benchmark_json),
+        ):
+            if os.path.exists(path):
+                model = loader(path)
+                break
+        else:
+            model = CostModel.from_csv_baselines(_module_path(""))
+        anchor = "iterative"
+        scale = 1.0
+        if anchor in model.coefficients:
+            nodes = (1 << 12) - 1
+            a, b = _PRIOR_COEFFICIENTS[anchor]
+            scale = model.predict_time(anchor, nodes) / (a * nodes + b)
+        for name, (a, b) in _PRIOR_COEFFICIENTS.items():
+            if name not in model.coefficients:
+                model.coefficients[name] = (a * scale, b * scale)
+                model.source[name] = "prior"
+        _default_model = model
+    return _default_model
+
+
+def choose_strategy(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    model: Optional[CostModel] = None,
+) -> Tuple[str, Optional[float]]:
+    """Стратегия с наименьшим предсказанным временем и само это время."""
+    model = model or default_cost_model()
+    nodes = (1 << max(int(data["height"]), 1)) - 1
+    has_rule = rule_from_callables(left_fn, right_fn) is not None
+    best: Tuple[str, Optional[float]] = ("iterative", model.predict_time("iterative", nodes))
+    for name, strategy in _STRATEGIES.items():
+        if strategy.needs_rule and not has_rule:
+            continue
+        t = model.predict_time(name, nodes)
+        if t is not None and (best[1] is None or t < best[1]):
+            best = (name, t)
+    return best
+
+
+def build_tree(
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int] = left_child_variant_14,
+    right_fn: Callable[[int], int] = right_child_variant_14,
+    strategy: str = "auto",
+    time_budget: Optional[float] = None,
+    memory_budget: Optional[int] = None,
+    on_budget: str = "raise",
+    model: Optional[CostModel] = None,
+) -> List[List[int]]:
+    """
+    Одна точка входа вместо выбора между build_tree_iterative/recursive/...
+
+    strategy="auto" — беру стратегию с наименьшим временем по модели
+    стоимости (по умолчанию default_cost_model, без замеров при вызове). numpy и compiled
+    рассматриваются, только если пару функций удалось узнать как аффинное правило.
+    Можно назвать стратегию явно (см. strategies()).
+
+    time_budget (секунды) и memory_budget (байты): если оценка больше,
+    при on_budget="raise" бросаю BudgetExceededError ещё до построения,
+    при on_budget="warn" — предупреждение RuntimeWarning и строю всё равно.
+    Память оцениваю по байтам на узел для обычных int; при big int
+    (огромный корень) настоящая цифра будет больше.
+
+    Возвращает:
+        Список уровней, как build_tree_iterative.
+    """
+    if on_budget not in ("raise", "warn"):
+        raise ValueError("on_budget должен быть 'raise' или 'warn'")
+    nodes = (1 << max(int(data["height"]), 1)) - 1
+    if strategy == "auto":
+        model = model or default_cost_model()
+        strategy, predicted = choose_strategy(data, left_fn, right_fn, model)
+    else:
+        if strategy not in _STRATEGIES:
+            raise ValueError(f"неизвестная стратегия {strategy!r}: есть {', '.join(strategies())}")
+        if time_budget is not None or memory_budget is not None:
+            model = model or default_cost_model()
+        predicted = model.predict_time(strategy, nodes) if model is not None else None
+
+    problems: List[str] = []
+    if time_budget is not None and predicted is not None and predicted > time_budget:
+        problems.append(f"время ~{predicted:.3g} с > {time_budget:.3g} с")
+    if memory_budget is not None and model is not None:
+        memory = model.predict_memory(strategy, nodes)
+        if memory > memory_budget:
+            problems.append(f"память ~{memory:.3g} байт > {memory_budget} байт")
+    if problems:
+        message = f"build_tree ({strategy}, {nodes} узлов): " + ", ".join(problems)
+        if on_budget == "raise":
+            raise BudgetExceededError(message)
+        import warnings
+        warnings.warn(message, RuntimeWarning, stacklevel=2)
+
+    return _STRATEGIES[strategy].builder(data, left_fn, right_fn)
+
+
+# ---------------- Эксперименты: описание и изолированный запуск ----------------
+class ExperimentSpec(NamedTuple):
+    """Одно сравнение "A vs B": что мерить, куда сохранить и как подписать график."""
+
+    name: str
+    builder_a: Builder
+    left_a: Callable[[int], int]
+    right_a: Callable[[int], int]
+    builder_b: Builder
+    left_b: Callable[[int], int]
+    right_b: Callable[[int], int]
+    header_a: str
+    header_b: str
+    label_a: str
+    label_b: str
+    title: str
+
+
+EXPERIMENTS: List[ExperimentSpec] = [
+    # 1) recursive(no cache) vs iterative(no cache)
+    ExperimentSpec(
+        "exp1_rec_vs_it_no_cache",
+        build_tree_recursive, left_child_variant_14, right_child_variant_14,
+        build_tree_iterative, left_child_variant_14, right_child_variant_14,
+        "recursive_nc", "iterative_nc",
+        "recursive (no cache)", "iterative (no cache)",
+        "Сравнение: рекурсивный vs нерекурсивный (без кэша)",
+    ),
+    # 2) recursive(no cache) vs recursive(cached)
+    ExperimentSpec(
+        "exp2_rec_nc_vs_rec_cached",
+        build_tree_recursive, left_child_variant_14, right_child_variant_14,
+        build_tree_recursive, left_child_variant_14_cached, right_child_variant_14_cached,
+        "recursive_nc", "recursive_cached",
+        "recursive (no cache)", "recursive (cached)",
+        "Сравнение: рекурсивный без кэша vs рекурсивный с кэшем",
+    ),
+    # 3) iterative(no cache) vs iterative(cached)
+    ExperimentSpec(
+        "exp3_it_nc_vs_it_cached",
+        build_tree_iterative, left_child_variant_14, right_child_variant_14,
+        build_tree_iterative, left_child_variant_14_cached, right_child_variant_14_cached,
+        "iterative_nc", "iterative_cached",
+        "iterative (no cache)", "iterative (cached)",
+        "Сравнение: нерекурсивный без кэша vs нерекурсивный с кэшем",
+    ),
+    # 4) recursive(cached) vs iterative(cached)
+    ExperimentSpec(
+        "exp4_rec_cached_vs_it_cached",
+        build_tree_recursive, left_child_variant_14_cached, right_child_variant_14_cached,
+        build_tree_iterative, left_child_variant_14_cached, right_child_variant_14_cached,
+        "recursive_cached", "iterative_cached",
+        "recursive (cached)", "iterative (cached)",
+        "Сравнение: рекурсивный vs нерекурсивный (оба с кэшем)",
+    ),
+    # 5) iterative(no cache) vs numpy (векторный движок)
+    ExperimentSpec(
+        "exp5_it_vs_numpy",
+        build_tree_iterative, left_child_variant_14, right_child_variant_14,
+        build_tree_numpy, left_child_variant_14, right_child_variant_14,
+        "iterative_nc", "numpy",
+        "iterative (no cache)", "numpy (vectorized)",
+        "Сравнение: нерекурсивный vs векторный (numpy)",
+    ),
+    # 6) iterative(no cache) vs скомпилированное аффинное правило (python-ядро)
+    ExperimentSpec(
+        "exp6_it_vs_compiled",
+        build_tree_iterative, left_child_variant_14, right_child_variant_14,
+        build_tree_compiled, VARIANT_14.left, VARIANT_14.right,
+        "iterative_nc", "compiled",
+        "iterative (no cache)", "compiled affine rule",
+        "Сравнение: нерекурсивный vs скомпилированное правило",
+    ),
+    # 11) recursive(no cache) vs связное дерево из Node (DFS с явным стеком)
+    ExperimentSpec(
+        "exp11_rec_vs_node_tree",
+        build_tree_recursive, left_child_variant_14, right_child_variant_14,
+        build_node_tree, left_child_variant_14, right_child_variant_14,
+        "recursive_nc", "node_tree",
+        "recursive (no cache)", "Node tree (explicit stack)",
+        "Сравнение: рекурсивный (уровни) vs связное дерево Node",
+    ),
+]
+
+EXPERIMENTS_BY_NAME: Dict[str, ExperimentSpec] = {spec.name: spec for spec in EXPERIMENTS}
+
+
+def run_experiment(
+    spec: ExperimentSpec,
+    root: int,
+    heights: List[int],
+    repeat: int,
+    number: int,
+) -> List[Tuple[int, float, float]]:
+    """Один эксперимент через benchmark_by_heights, всегда с холодными lru_cache."""
+    clear_legacy_caches()
+    return benchmark_by_heights(
+        spec.builder_a, spec.builder_b,
+        spec.left_a, spec.right_a,
+        spec.left_b, spec.right_b,
+        root, heights, repeat, number
+    )
+
+
+def save_experiment(spec: ExperimentSpec, rows: List[Tuple[int, float, float]]) -> None:
+    """CSV и PNG эксперимента под его именем (exp1_... .csv / .png)."""
+    save_csv(rows, f"{spec.name}.csv", spec.header_a, spec.header_b)
+    plot_two_series(rows, spec.label_a, spec.label_b, spec.title, f"{spec.name}.png")
+
+
+# Очередь свободных ядер в процессе-работнике (заполняет _init_isolated_worker).
+_free_cpus: Any = None
+
+
+def _init_isolated_worker(free_cpus: Any) -> None:
+    global _free_cpus
+    _free_cpus = free_cpus
+
+
+def _run_experiment_isolated(
+    task: Tuple[str, int, List[int], int, int],
+) -> Tuple[str, List[Tuple[int, float, float]]]:
+    """
+    Задача для свежего процесса: беру свободное ядро из очереди,
+    привязываюсь к нему (если ОС умеет sched_setaffinity), меряю и отдаю ядро обратно.
+    """
+    name, root, heights, repeat, number = task
+    cpu = _free_cpus.get() if _free_cpus is not None else None
+    try:
+        if cpu is not None and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, {cpu})
+        return name, run_experiment(EXPERIMENTS_BY_NAME[name], root, heights, repeat, number)
+    finally:
+        if cpu is not None:
+            _free_cpus.put(cpu)
+
+
+def available_cpus() -> List[int]:
+    """Ядра, на которых этому процессу разрешено работать."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def run_experiments_isolated(
+    specs: List[ExperimentSpec],
+    root: int,
+    heights: List[int],
+    repeat: int,
+    number: int,
+    per_height: bool = False,
+    cpus: Optional[List[int]] = None,
+) -> Dict[str, List[Tuple[int, float, float]]]:
+    """
+    Запускаю каждый эксперимент (или, с per_height=True, каждую высоту
+    каждого эксперимента) в отдельном свежем процессе, привязанном к своему ядру.
+
+    Процессы создаются через spawn и живут ровно одну задачу
+    (Pool с maxtasksperchild=1), поэтому тёплые lru_cache и фрагментация кучи
+    из одного эксперимента не попадают в другой. Одновременно работает
+    не больше процессов, чем ядер, и на одном ядре — только один.
+
+    Возвращает:
+        {имя эксперимента: строки (height, A, B)}, как у benchmark_by_heights.
+    """
+    # Импортирую здесь, а не наверху: multiprocessing заметно замедляет импорт модуля.
+    import multiprocessing
+
+    cpus = cpus or available_cpus()
+    tasks: List[Tuple[str, int, List[int], int, int]] = []
+    for spec in specs:
+        if per_height:
+            tasks.extend((spec.name, root, [h], repeat, number) for h in heights)
+        else:
+            tasks.append((spec.name, root, list(heights), repeat, number))
+
+    ctx = multiprocessing.get_context("spawn")
+    free_cpus = ctx.Queue()
+    for cpu in cpus:
+        free_cpus.put(cpu)
+
+    results: Dict[str, List[Tuple[int, float, float]]] = {spec.name: [] for spec in specs}
+    # Pool, а не ProcessPoolExecutor: max_tasks_per_child у того появился только в 3.11.
+    with ctx.Pool(
+        processes=max(1, min(len(tasks), len(cpus))),
+        initializer=_init_isolated_worker,
+        initargs=(free_cpus,),
+        maxtasksperchild=1,
+    ) as pool:
+        for name, rows in pool.imap(_run_experiment_isolated, tasks):
+            results[name].extend(rows)
+    for rows in results.values():
+        rows.sort()
+    return results
+
+
+# ---------------- Сравнение с сохранёнными замерами (регрессии) ----------------
+# База для compare лежит отдельно от exp*.csv отчёта, в папке BASELINE_DIR рядом
+# с этим файлом: {name}.csv и CALIBRATION_FILE (время калибровочного цикла
+# на той машине). Пишет их только rebaseline (compare --rebaseline), так что
+# bench их не трогает. Если папки нет, compare сравнивает с exp*.csv отчёта.
+BASELINE_DIR = "bench_baseline"
+CALIBRATION_FILE = "bench_calibration.json"
+
+
+def _calibration_workload() -> int:
+    """
+    Фиксированный цикл на чистом Python для оценки скорости машины.
+    Специально не вызывает ничего из этого файла: иначе замедление
+    построителей "съелось" бы калибровкой и не было бы заметно.
+    """
+    total = 0
+    for i in range(200_000):
+        total += (i * 7) ^ (i >> 3)
+    return total
+
+
+def measure_calibration(repeat: int = 15) -> float:
+    """Минимальное время калибровочного цикла (секунды)."""
+    return time_function(_calibration_workload, repeat=repeat)
+
+
+def save_calibration(path: str = CALIBRATION_FILE, seconds: Optional[float] = None) -> Dict[str, Any]:
+    """Меряю калибровку (если seconds не передали) и сохраняю рядом с CSV базовых замеров."""
+    info = {
+        "seconds": measure_calibration() if seconds is None else seconds,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return info
+
+
+def load_calibration(path: str = CALIBRATION_FILE) -> Optional[float]:
+    """Время калибровки базовой машины или None, если файла нет."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return float(json.load(f)["seconds"])
+
+
+def repeat_samples(
+    run: Callable[[], Any],
+    repeat: int,
+    number: int,
+    calibrated: bool = False,
+) -> List[float]:
+    """
+    repeat замеров run по number вызовов (как timeit.repeat).
+
+    calibrated=True: каждый замер делю на время калибровочного цикла, снятое
+    прямо перед ним, и получаю время в "калибровочных циклах". Медленная минута
+    ВМ (соседи, троттлинг) замедляет и то и другое, и в отношении почти
+    сокращается — одна калибровка на весь прогон такие провалы не ловит.
+    """
+    if not calibrated:
+        return timeit.repeat(run, repeat=repeat, number=number)
+    samples: List[float] = []
+    for _ in range(repeat):
+        calibration = timeit.timeit(_calibration_workload, number=1)
+        samples.append(timeit.timeit(run, number=number) / calibration)
+    return samples
+
+
+def measure_experiment_samples(
+    spec: ExperimentSpec,
+    root: int,
+    heights: List[int],
+    repeat: int,
+    number: int,
+    calibrated: bool = False,
+) -> List[Tuple[int, List[float], List[float]]]:
+    """
+    Как run_experiment, но возвращаю все repeat замеров A и B на каждой высоте,
+    а не только минимум: по их разбросу считается порог шума.
+    calibrated — как в repeat_samples.
+    """
+    clear_legacy_caches()
+    rows: List[Tuple[int, List[float], List[float]]] = []
+    for h in heights:
+        data = {"root": root, "height": h}
+        samples_a = repeat_samples(lambda: spec.builder_a(data, spec.left_a, spec.right_a),
+                                   repeat, number, calibrated)
+        samples_b = repeat_samples(lambda: spec.builder_b(data, spec.left_b, spec.right_b),
+                                   repeat, number, calibrated)
+        rows.append((h, samples_a, samples_b))
+    return rows
+
+
+_COMPARE_FIELDS = ["experiment", "series", "height", "baseline", "current", "normalized",
+                   "ratio", "limit", "regression"]
+
+
+def compare_with_baselines(
+    specs: Optional[List[ExperimentSpec]] = None,
+    root: int = 14,
+    repeat: int = 9,
+    number: int = 50,
+    threshold: float = 0.10,
+    noise_k: float = 3.0,
+    confirm: int = 3,
+    report_path: str = "compare_report.csv",
+    plots: bool = True,
+    directory: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Перезапускаю эксперименты, для которых есть сохранённый {name}.csv,
+    на тех же высотах и с теми же repeat/number (как в run_benchmarks),
+    и сравниваю с ними. Базовые CSV и CALIBRATION_FILE ищу в directory,
+    по умолчанию — в BASELINE_DIR рядом с этим файлом, а если его нет,
+    то в exp*.csv рядом с этим файлом, так что запускать можно из любой
+    папки. Если сравнивать не с чем, бросаю ValueError.
+
+    Скорость машины:
+      - есть CALIBRATION_FILE (база от rebaseline): меряю так же, как rebaseline, —
+        каждый замер в калибровочных циклах (repeat_samples, calibrated=True),
+        беру медиану и умножаю на калибровку базы;
+      - нет (exp*.csv отчёта): беру минимум замеров и делю на медиану отношений
+        "новое / базовое" по всем точкам — тогда равномерное замедление всего
+        кода не видно, а видны только отдельные провалы.
+    В отчёте current — эта статистика как есть (в циклах или секундах),
+    normalized — приведённая к базе.
+
+    Порог шума: точка считается регрессией, если
+        нормированное / базовое > 1 + max(threshold, noise_k * IQR / медиана),
+    где IQR и медиана — по новым repeat замерам этой точки. Точку выше порога
+    перемеряю ещё до confirm раз. Регрессия — только если точка выше порога
+    в каждом раунде; в отчёт идёт лучший раунд.
+
+    Пишу отчёт report_path (строка на серию и высоту) и, если plots,
+    графики compare_{name}_{серия}.png: база vs нормированный новый замер.
+
+    Возвращает:
+        Строки отчёта; регрессия есть, если хоть у одной regression == True.
+    """
+    import statistics
+
+    if directory is None:
+        directory = _module_path(BASELINE_DIR)
+        if not os.path.isdir(directory):
+            directory = _module_path("")
+    if specs is None:
+        specs = [spec for spec in EXPERIMENTS
+                 if os.path.exists(os.path.join(directory, f"{spec.name}.csv"))]
+    if not specs:
+        raise ValueError(f"в {directory} нет сохранённых exp*.csv — сравнивать не с чем")
+
+    base_calibration = load_calibration(os.path.join(directory, CALIBRATION_FILE))
+    calibrated = base_calibration is not None
+    pick: Callable[[List[float]], float] = statistics.median if calibrated else min
+
+    measured: List[Tuple[ExperimentSpec, str, int, float, List[float], Callable[[], Any]]] = []
+    for spec in specs:
+        base_rows, header_a, header_b = load_csv(os.path.join(directory, f"{spec.name}.csv"))
+        heights = [h for h, _, _ in base_rows]
+        baseline = {h: (a, b) for h, a, b in base_rows}
+        for h, samples_a, samples_b in measure_experiment_samples(spec, root, heights, repeat, number,
+                                                                  calibrated):
+            data = {"root": root, "height": h}
+            measured.append((spec, header_a, h, baseline[h][0], samples_a,
+                             partial(spec.builder_a, data, spec.left_a, spec.right_a)))
+            measured.append((spec, header_b, h, baseline[h][1], samples_b,
+                             partial(spec.builder_b, data, spec.left_b, spec.right_b)))
+
+    if not measured:
+        raise ValueError("в базовых CSV нет ни одной высоты — сравнивать не с чем")
+
+    if base_calibration is not None:
+        scale = base_calibration
+        speed = measure_calibration() / base_calibration
+        print(f"Калибровка: эта машина в {speed:.2f} раза медленнее базовой "
+              f"(замеры нормирую калибровкой рядом с каждым)")
+    else:
+        speed = statistics.median(pick(samples) / base for _, _, _, base, samples, _ in measured)
+        scale = 1 / speed
+        print(f"Нет {CALIBRATION_FILE}: нормирую по медиане отношений ({speed:.2f})")
+
+    report: List[Dict[str, Any]] = []
+    for spec, series, h, base, samples, run_once in measured:
+        q1, median, q3 = statistics.quantiles(samples, n=4)
+        limit = 1 + max(threshold, noise_k * (q3 - q1) / median)
+        current = pick(samples)
+        # Подозрительную точку перемеряю ещё до confirm раз: регрессия должна
+        # держаться в каждом раунде, а не в одном неудачном.
+        for _ in range(confirm):
+            if current * scale / base <= limit:
+                break
+            # lru_cache к этому моменту прогрет всеми высотами до максимальной, а большой
+            # словарь медленнее маленького. Сбрасываю и прогреваю только этой высотой —
+            # как было в основном проходе (дерево меньшей высоты — префикс этого).
+            clear_legacy_caches()
+            run_once()
+            current = min(current, pick(repeat_samples(run_once, repeat, number, calibrated)))
+        normalized = current * scale
+        ratio = normalized / base
+        report.append({
+            "experiment": spec.name,
+            "series": series,
+            "height": h,
+            "baseline": base,
+            "current": current,
+            "normalized": normalized,
+            "ratio": ratio,
+            "limit": limit,
+            "regression": ratio > limit,
+        })
+
+    with open(report_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=_COMPARE_FIELDS)
+        w.writeheader()
+        for row in report:
+            w.writerow({**row, "baseline": f"{row['baseline']:.8f}", "current": f"{row['current']:.8f}",
+                        "normalized": f"{row['normalized']:.8f}", "ratio": f"{row['ratio']:.3f}",
+                        "limit": f"{row['limit']:.3f}"})
+
+    if plots:
+        for spec in specs:
+            for series in sorted({row["series"] for row in report if row["experiment"] == spec.name}):
+                rows = [(row["height"], row["baseline"], row["normalized"])
+                        for row in report if row["experiment"] == spec.name and row["series"] == series]
+                plot_two_series(
+                    rows,
+                    f"{series} (baseline CSV)",
+                    f"{series} (current, normalized)",
+                    f"Регрессии: {spec.name}, {series}",
+                    f"compare_{spec.name}_{series}.png",
+                )
+    return report
+
+
+def rebaseline(
+    specs: Optional[List[ExperimentSpec]] = None,
+    root: int = 14,
+    heights: Optional[List[int]] = None,
+    repeat: int = 9,
+    number: int = 50,
+    directory: Optional[str] = None,
+    rounds: int = 3,
+) -> List[str]:
+    """
+    Новая база для compare: заново меряю эксперименты (по умолчанию exp1–exp4)
+    тем же способом, что и compare (подряд в этом процессе, каждый замер
+    в калибровочных циклах), и пишу {name}.csv вместе с CALIBRATION_FILE
+    в directory (по умолчанию BASELINE_DIR рядом с этим файлом).
+    exp*.csv отчёта не трогаю.
+
+    Меряю rounds полных проходов и беру медиану по всем их замерам: одна
+    удачная (или неудачная) минута ВМ иначе сдвинула бы базу для всех
+    будущих compare. В CSV медиана умножена на калибровку, т.е. это секунды
+    на этой машине в её лучшем темпе. Возвращаю записанные файлы.
+    """
+    import statistics
+
+    if directory is None:
+        directory = _module_path(BASELINE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    if specs is None:
+        specs = EXPERIMENTS[:4]
+    if heights is None:
+        heights = list(range(4, 17))
+    pooled: Dict[Tuple[str, int], Tuple[List[float], List[float]]] = {}
+    for _ in range(rounds):
+        for spec in specs:
+            for h, samples_a, samples_b in measure_experiment_samples(spec, root, heights, repeat, number,
+                                                                      calibrated=True):
+                all_a, all_b = pooled.setdefault((spec.name, h), ([], []))
+                all_a.extend(samples_a)
+                all_b.extend(samples_b)
+    seconds = measure_calibration()
+    written: List[str] = []
+    for spec in specs:
+        rows = [(h, statistics.median(pooled[spec.name, h][0]) * seconds,
+                 statistics.median(pooled[spec.name, h][1]) * seconds)
+                for h in heights]
+        csv_path = os.path.join(directory, f"{spec.name}.csv")
+        save_csv(rows, csv_path, spec.header_a, spec.header_b)
+        written.append(csv_path)
+    calibration_path = os.path.join(directory, CALIBRATION_FILE)
+    save_calibration(calibration_path, seconds)
+    written.append(calibration_path)
+    return written
+
+
+# ---------------- Главный сценарий: все сравнения и графики ----------------
+def run_benchmarks(isolated: bool = True, per_height: bool = False) -> None:
+    """
+    Здесь я запускаю эксперименты из твоего списка:
+
+    1) Рекурсивный и нерекурсивный (оба без кэша)
+    2) Рекурсивный без кэша и рекурсивный с кэшем
+    3) Нерекурсивный без кэша и с кэшем
+    4) Рекурсивный и нерекурсивный с кэшем
+       (для 2–4 ещё отдельно холодный и тёплый ChildCache)
+    5) Нерекурсивный и векторный (build_tree_numpy), оба без кэша
+    6) Нерекурсивный и скомпилированное аффинное правило (build_tree_compiled)
+    7) Подключаемые кэши (dict/LRU/LFU): холодный vs тёплый
+    8) Проход по высотам: пересборка с нуля vs TreeBuilder.extend_to
+    9) Поиск позиций значения: просмотр уровней vs find_positions
+    10) Рост big int: точные значения vs модуль 2**64 (по длине корня в битах)
+    11) Рекурсивный (уровни) и связное дерево из Node (build_node_tree)
+    12) Много корней: цикл build_tree_iterative vs пакетный build_tree_batch
+    13) Потоки (build_tree_threaded): время по числу потоков против одного потока
+
+    Эксперименты 1–6 и 11 описаны в EXPERIMENTS. По умолчанию (isolated=True)
+    каждый идёт в своём свежем процессе на своём ядре
+    (run_experiments_isolated), так что они не делят тёплые lru_cache
+    и заканчиваются быстрее. isolated=False — старый последовательный
+    режим в одном процессе (lru_cache всё равно сбрасываются перед каждым).
+
+    Для каждого делаю отдельный CSV и отдельный PNG.
+    Высоты можно поменять ниже (heights_to_test).
+    """
+    sanity_check_same_structure()
+
+    root = 14
+    heights_to_test = list(range(4, 17))  # 2..12 достаточно, чтобы был тренд
+    repeat = 9
+    number = 50
+
+    if isolated:
+        results = run_experiments_isolated(
+            EXPERIMENTS, root, heights_to_test, repeat, number, per_height=per_height
+        )
+    else:
+        results = {
+            spec.name: run_experiment(spec, root, heights_to_test, repeat, number)
+            for spec in EXPERIMENTS
+        }
+    for spec in EXPERIMENTS:
+        save_experiment(spec, results[spec.name])
+
+    # 2–4) То же с ChildCache: холодный (reset перед каждым замером) и тёплый отдельно.
+    # lru_cache в exp2–exp4 так не разделить — он общий на весь процесс.
+    cold_warm: Dict[str, List[Tuple[int, float, float]]] = {}
+    for name, builder in (("rec", build_tree_recursive), ("it", build_tree_iterative)):
+        cache = make_cache("lru", maxsize=4096)
+        cold_warm[name] = benchmark_cold_warm(
+            builder, left_child_variant_14, right_child_variant_14,
+            cache, root, heights_to_test, repeat
+        )
+    for exp, name, title in (("exp2", "rec", "рекурсивный"), ("exp3", "it", "нерекурсивный")):
+        rows = cold_warm[name]
+        save_csv(rows, f"{exp}_{name}_cached_cold_vs_warm.csv", f"{name}_cold", f"{name}_warm")
+        plot_two_series(
+            rows,
+            f"{title} (cold)",
+            f"{title} (warm)",
+            f"ChildCache (LRU): холодный vs тёплый ({title})",
+            f"{exp}_{name}_cached_cold_vs_warm.png",
+        )
+    for state, col in (("cold", 1), ("warm", 2)):
+        rows = [(rec[0], rec[col], it[col]) for rec, it in zip(cold_warm["rec"], cold_warm["it"])]
+        save_csv(rows, f"exp4_{state}_rec_vs_it.csv", f"recursive_{state}", f"iterative_{state}")
+        plot_two_series(
+            rows,
+            f"recursive ({state})",
+            f"iterative ({state})",
+            f"ChildCache (LRU), {state}: рекурсивный vs нерекурсивный",
+            f"exp4_{state}_rec_vs_it.png",
+        )
+
+    # 7) Подключаемые кэши: холодный vs тёплый для каждого вида кэша
+    for kind in ("dict", "lru", "lfu"):
+        cache = make_cache(kind, maxsize=4096)
+        rows7 = benchmark_cold_warm(
+            build_tree_iterative, left_child_variant_14, right_child_variant_14,
+            cache, root, heights_to_test, repeat
+        )
+        save_csv(rows7, f"exp7_cache_{kind}_cold_vs_warm.csv", f"{kind}_cold", f"{kind}_warm")
+        plot_two_series(
+            rows7,
+            f"{kind} (cold)",
+            f"{kind} (warm)",
+            f"Кэш {kind}: холодный vs тёплый (нерекурсивный)",
+            f"exp7_cache_{kind}_cold_vs_warm.png",
+        )
+        print(f"Кэш {kind}:", cache.stats())
+
+    # 8) Проход по высотам: пересборка с нуля vs достраивание (TreeBuilder)
+    rows8 = benchmark_sweep(root, heights_to_test, repeat)
+    save_csv(rows8, "exp8_sweep_rebuild_vs_incremental.csv", "rebuild", "incremental")
+    plot_two_series(
+        rows8,
+        "rebuild each height",
+        "TreeBuilder.extend_to",
+        "Проход по высотам 4..N: пересборка vs достраивание",
+        "exp8_sweep_rebuild_vs_incremental.png",
+    )
+
+    # 9) Где встречается значение: просмотр всех уровней vs обратный поиск
+    rows9 = benchmark_find_positions(root, heights_to_test, value=-22, repeat=repeat)
+    save_csv(rows9, "exp9_find_scan_vs_search.csv", "scan", "find_positions")
+    plot_two_series(
+        rows9,
+        "scan build_tree_iterative",
+        "find_positions",
+        "Поиск позиций значения -22: просмотр vs обратный поиск",
+        "exp9_find_scan_vs_search.png",
+    )
+
+    # 10) Рост big int: точные значения vs по модулю 2**64 (высота 12, корень всё длиннее)
+    rows10 = benchmark_bigint_growth(12, [16, 64, 256, 1024, 4096, 16384], repeat)
+    save_csv(rows10, "exp10_bigint_exact_vs_mod64.csv", "exact", "mod64")
+    plot_two_series(
+        rows10,
+        "exact (big int)",
+        "mod 2**64",
+        "Рост big int: точные значения vs по модулю 2**64 (height=12)",
+        "exp10_bigint_exact_vs_mod64.png",
+        xlabel="root bit length",
+    )
+
+    # 12) Много корней сразу: цикл по корням vs один блок (build_tree_batch).
+    # Блок 1000 x (2**h - 1), поэтому высоты до 12, чтобы не съесть всю память.
+    batch_roots = list(range(-500, 500))
+    rows12 = benchmark_batch(batch_roots, [h for h in heights_to_test if h <= 12], repeat)
+    save_csv(rows12, "exp12_batch_loop_vs_batch.csv", "loop_iterative", "batch")
+    plot_two_series(
+        rows12,
+        "loop of build_tree_iterative",
+        "build_tree_batch",
+        f"{len(batch_roots)} корней: цикл vs пакетное построение",
+        "exp12_batch_loop_vs_batch.png",
+    )
+
+    # 13) Масштабирование по потокам. С GIL ускорения не будет — это и видно на графике.
+    thread_counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    rows13 = benchmark_thread_scaling(root, 18, thread_counts, repeat)
+    save_csv(rows13, "exp13_threads_scaling.csv", "iterative", "threaded", first_header="threads")
+    gil_note = "GIL включён" if gil_enabled() else "без GIL"
+    plot_two_series(
+        rows13,
+        "build_tree_iterative (1 thread)",
+        "build_tree_threaded",
+        f"Потоки по уровням, height=18 ({gil_note})",
+        "exp13_threads_scaling.png",
+        xlabel="threads",
+    )
+
+    # Сводный замер всех построителей: медиана, IQR, нс на узел — в JSON.
+    suite = default_suite()
+    suite.run(root, heights_to_test)
+    suite.run_import_time()
+
+    # Память: пик tracemalloc и байты на узел для каждого построителя.
+    mem_rows = suite.run_memory(root, heights_to_test)
+    save_memory_csv(mem_rows, "mem_results.csv")
+    plot_two_series(
+        pair_series(mem_rows, "iterative_nc", "flat", "result_bytes"),
+        "iterative (List[List[int]])",
+        "FlatTree (array('q'))",
+        "Память: вложенные списки vs плоский буфер",
+        "mem_iterative_vs_flat.png",
+        ylabel="result bytes",
+    )
+    plot_two_series(
+        pair_series(mem_rows, "iterative_nc", "iterative_cached", "retained_bytes"),
+        "iterative (no cache)",
+        "iterative (lru_cache)",
+        "Память: что остаётся после построения (кэш lru_cache)",
+        "mem_iterative_cache_retained.png",
+        ylabel="retained bytes",
+    )
+    plot_two_series(
+        pair_series(mem_rows, "recursive_nc", "node_tree", "bytes_per_node"),
+        "recursive (List[List[int]])",
+        "Node tree (__slots__)",
+        "Память на узел: списки уровней vs связное дерево Node",
+        "mem_recursive_vs_node_tree.png",
+        ylabel="bytes per node",
+    )
+    suite.save_json("bench_results.json")
+
+    print("\nГотово. Сохранены CSV и PNG для всех сравнений.")
+    print("Файлы:")
+    print(" - exp1_rec_vs_it_no_cache.csv / .png")
+    print(" - exp2_rec_nc_vs_rec_cached.csv / .png")
+    print(" - exp3_it_nc_vs_it_cached.csv / .png")
+    print(" - exp4_rec_cached_vs_it_cached.csv / .png")
+    print(" - exp2_rec_cached_cold_vs_warm, exp3_it_cached_cold_vs_warm,"
+          " exp4_{cold,warm}_rec_vs_it .csv / .png (ChildCache)")
+    print(" - exp5_it_vs_numpy.csv / .png")
+    print(" - exp6_it_vs_compiled.csv / .png")
+    print(" - exp7_cache_{dict,lru,lfu}_cold_vs_warm.csv / .png")
+    print(" - exp8_sweep_rebuild_vs_incremental.csv / .png")
+    print(" - exp9_find_scan_vs_search.csv / .png")
+    print(" - exp10_bigint_exact_vs_mod64.csv / .png")
+    print(" - exp11_rec_vs_node_tree.csv / .png")
+    print(" - exp12_batch_loop_vs_batch.csv / .png")
+    print(" - exp13_threads_scaling.csv / .png")
+    print(" - bench_results.json (все построители: min/медиана/IQR/нс на узел, время импорта)")
+    print(" - mem_results.csv, mem_iterative_vs_flat.png, mem_iterative_cache_retained.png,"
+          " mem_recursive_vs_node_tree.png")
+    print("\nКороткий комментарий:")
+    print(
+        "Кэширование ускоряет случаи, где часто повторяются одинаковые входы для функций\n"
+        "вычисления потомков. В нашей задаче это может проявляться, когда значения узлов\n"
+        "на разных позициях совпадают. Итеративный подход обычно и так немного быстрее,\n"
+        "но с кэшем обе версии выигрывают. Точный эффект зависит от высоты и повтора значений."
+    )
+
+
+
+# ---------------- Командная строка ----------------
+_CLI_BUILDERS: Dict[str, Builder] = {
+    "iterative": build_tree_iterative,
+    "recursive": build_tree_recursive,
+    "numpy": build_tree_numpy,
+    "compiled": build_tree_compiled,
+    "auto": build_tree,
+}
+
+
+def replot_experiments() -> List[str]:
+    """Перерисовываю PNG экспериментов по уже сохранённым CSV, без новых замеров."""
+    written: List[str] = []
+    for spec in EXPERIMENTS:
+        path = f"{spec.name}.csv"
+        if not os.path.exists(path):
+            continue
+        rows, _, _ = load_csv(path)
+        plot_two_series(rows, spec.label_a, spec.label_b, spec.title, f"{spec.name}.png")
+        written.append(f"{spec.name}.png")
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Командная строка:
+
+        python binary_tree_step3.py build --root 14 --height 4 [--builder iterative] [--format text|csv]
+        python binary_tree_step3.py bench [--sequential] [--per-height]
+        python binary_tree_step3.py plot
+        python binary_tree_step3.py query --root 14 --level 40 --index 12345
+        python binary_tree_step3.py compare [--threshold 0.1] [--no-plots] [--rebaseline]
+        python binary_tree_step3.py calibrate
+
+    Без подкоманды — как раньше, все эксперименты (то же, что bench).
+    matplotlib импортируется только в bench/plot, поэтому build и query
+    стартуют быстро и не требуют дисплея.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Бинарное дерево, вариант №14")
+    sub = parser.add_subparsers(dest="command")
+
+    p_build = sub.add_parser("build", help="построить дерево и вывести уровни")
+    p_build.add_argument("--root", type=int, default=14)
+    p_build.add_argument("--height", type=int, default=4)
+    p_build.add_argument("--builder", choices=sorted(_CLI_BUILDERS), default="iterative")
+    p_build.add_argument("--format", choices=["text", "csv"], default="text")
+
+    p_bench = sub.add_parser("bench", help="все эксперименты: CSV, PNG и bench_results.json")
+    p_bench.add_argument("--sequential", action="store_true",
+                         help="в одном процессе, без изоляции по ядрам")
+    p_bench.add_argument("--per-height", action="store_true",
+                         help="каждая высота в отдельном процессе")
+
+    sub.add_parser("plot", help="перерисовать PNG по готовым CSV")
+
+    p_query = sub.add_parser("query", help="значение одного узла без построения дерева")
+    p_query.add_argument("--root", type=int, default=14)
+    p_query.add_argument("--level", type=int, required=True)
+    p_query.add_argument("--index", type=int, required=True)
+
+    p_compare = sub.add_parser("compare", help="сравнить с базой bench_baseline/, код 1 при регрессии")
+    p_compare.add_argument("--threshold", type=float, default=0.10,
+                           help="допустимое замедление (доля), если шум меньше")
+    p_compare.add_argument("--report", default="compare_report.csv")
+    p_compare.add_argument("--no-plots", action="store_true")
+    p_compare.add_argument("--rebaseline", action="store_true",
+                           help="не сравнивать, а переписать базу в bench_baseline/ (exp1–exp4 и калибровку)")
+
+    sub.add_parser("calibrate", help="перемерить модель стоимости build_tree на этой машине")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        data = {"root": args.root, "height": args.height}
+        levels = _CLI_BUILDERS[args.builder](data, left_child_variant_14, right_child_variant_14)
+        out = csv.writer(sys.stdout) if args.format == "csv" else None
+        for i, level in enumerate(levels, start=1):
+            if out is not None:
+                out.writerow(level)
+            else:
+                print(f"Уровень {i}: {level}")
+    elif args.command == "plot":
+        for path in replot_experiments():
+            print(path)
+    elif args.command == "compare" and args.rebaseline:
+        for path in rebaseline():
+            print(path)
+    elif args.command == "compare":
+        try:
+            report = compare_with_baselines(threshold=args.threshold, report_path=args.report,
+                                            plots=not args.no_plots)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        slow = [row for row in report if row["regression"]]
+        for row in slow:
+            print(f"РЕГРЕССИЯ {row['experiment']} {row['series']} height={row['height']}: "
+                  f"x{row['ratio']:.2f} (порог x{row['limit']:.2f})", file=sys.stderr)
+        print(f"Точек: {len(report)}, регрессий: {len(slow)}. Отчёт: {args.report}")
+        return 1 if slow else 0
+    elif args.command == "calibrate":
+        model = CostModel().recalibrate()
+        model.save_json(_module_path(COST_MODEL_FILE))
+        for name in model.names():
+            a, b = model.coefficients[name]
+            print(f"{name:<10} {a * 1e9:8.1f} нс/узел + {b * 1e6:8.1f} мкс")
+    elif args.command == "query":
+        try:
+            print(node_value(args.root, args.level, args.index))
+        except IndexError as e:
+            print(e, file=sys.stderr)
+            return 2
+    else:
+        run_benchmarks(
+            isolated=not getattr(args, "sequential", False),
+            per_height=getattr(args, "per_height", False),
+        )
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
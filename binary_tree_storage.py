@@ -0,0 +1,393 @@
+from __future__ import annotations
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from binary_tree_step3 import iter_level_chunks
+
+
+# ---------------- Формат файла дерева ----------------
+# Заголовок фиксированного размера, дальше уровни подряд (в порядке кучи,
+# как у FlatTree): уровень k начинается с узла 2**k - 1.
+#
+#   magic    8 байт   b"BTREE\0\0\1"
+#   version  uint16
+#   rule_id  uint16   номер варианта (14 — наш)
+#   dtype    4 байта  код array с порядком байт, например b"<q\0\0"
+#   root     int64
+#   height   uint64
+#
+# Заголовок всегда little-endian, а сами значения — в порядке байт машины,
+# который и записан в dtype (чтобы читать через mmap без перекодирования).
+MAGIC = b"BTREE\x00\x00\x01"
+VERSION = 1
+_HEADER = struct.Struct("<8sHH4sqQ")
+_NATIVE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+
+def _level_offset(level: int, itemsize: int) -> int:
+    """Смещение начала уровня в файле (в байтах)."""
+    return _HEADER.size + ((1 << level) - 1) * itemsize
+
+
+def write_tree_file(
+    path: str,
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    rule_id: int = 14,
+    typecode: str = "q",
+    chunk_size: int = 1 << 20,
+) -> int:
+    """
+    Строю дерево и сразу пишу его в файл по кускам (iter_level_chunks),
+    так что в памяти одновременно живёт только один кусок уровня.
+    Так можно записать дерево, которое целиком в память не влезает.
+
+    Заголовок проверяю до open(): если корень не влезает в int64 заголовка
+    (или в typecode), высота или rule_id вне своих полей — ValueError.
+    Пишу во временный файл в той же папке и заменяю им path (os.replace)
+    только после успешной записи, так что при любой ошибке (например,
+    OverflowError на глубоком уровне) существующий файл по path остаётся
+    нетронутым, а обрезанный файл не появляется.
+
+    Возвращает:
+        Размер файла в байтах.
+    """
+    root: int = int(data["root"])
+    height: int = max(int(data["height"]), 1)
+    dtype = (_NATIVE_ORDER + typecode).encode("ascii").ljust(4, b"\x00")
+    try:
+        header = _HEADER.pack(MAGIC, VERSION, rule_id, dtype, root, height)
+        array(typecode, [root])
+    except (struct.error, OverflowError) as e:
+        raise ValueError(
+            f"дерево root={root}, height={height}, rule_id={rule_id} не записать в формате файла: {e}"
+        ) from None
+
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(path) + ".", suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(path)),
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            for level, _, chunk in iter_level_chunks(data, left_fn, right_fn, chunk_size):
+                try:
+                    f.write(array(typecode, chunk).tobytes())
+                except OverflowError:
+                    raise OverflowError(
+                        f"значения уровня {level} не помещаются в array('{typecode}')"
+                    ) from None
+            size = f.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+class MappedTree:
+    """
+    Дерево из файла write_tree_file, открытое через mmap.
+
+    Ничего не читается заранее: level(k) и node(k, i) — это O(1) по
+    смещению в файле, а страницы подгружает ОС при первом обращении.
+    Поэтому повторное открытие уже построенного дерева стоит
+    пару page fault'ов, а не новую сборку.
+
+    level(k) возвращает memoryview поверх mmap. Перед close() такие
+    срезы нужно отпустить (mv.release() или просто удалить),
+    иначе mmap не даст себя закрыть (BufferError).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path}: пустой файл, это не дерево") from None
+        self._nodes = None
+
+        try:
+            magic, version, rule_id, dtype, root, height = _HEADER.unpack_from(self._mmap, 0)
+        except struct.error:
+            self.close()
+            raise ValueError(f"{path}: файл короче заголовка") from None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path}: неизвестный формат файла")
+
+        code = dtype.rstrip(b"\x00").decode("ascii")
+        if code[0] != _NATIVE_ORDER:
+            self.close()
+            raise ValueError(f"{path}: записан с другим порядком байт ({code})")
+
+        self.rule_id: int = rule_id
+        self.root: int = root
+        self.height: int = height
+        self.typecode: str = code[1:]
+
+        itemsize = array(self.typecode).itemsize
+        expected = _level_offset(height, itemsize)
+        actual = len(self._mmap)
+        if actual != expected:
+            self.close()
+            raise ValueError(f"{path}: ожидалось {expected} байт, а в файле {actual}")
+        self._nodes = memoryview(self._mmap)[_HEADER.size:].cast(self.typecode)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def level(self, k: int) -> memoryview:
+        """Уровень k как memoryview поверх файла (без копирования)."""
+        if not 0 <= k < self.height:
+            raise IndexError(f"уровень {k} вне дерева высоты {self.height}")
+        return self._nodes[(1 << k) - 1:(1 << (k + 1)) - 1]
+
+    def node(self, level: int, index: int) -> int:
+        """Значение узла levels[level][index]."""
+        if not 0 <= level < self.height:
+            raise IndexError(f"уровень {level} вне дерева высоты {self.height}")
+        if not 0 <= index < (1 << level):
+            raise IndexError(f"индекс {index} вне уровня {level}")
+        return self._nodes[(1 << level) - 1 + index]
+
+    def to_levels(self) -> List[List[int]]:
+        """Обратно в обычный список уровней (только для маленьких высот)."""
+        return [self.level(k).tolist() for k in range(self.height)]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, list):
+            if len(other) != self.height:
+                return False
+            return all(self.level(k).tolist() == other[k] for k in range(self.height))
+        return NotImplemented
+
+    def close(self) -> None:
+        if self._nodes is not None:
+            self._nodes.release()
+            self._nodes = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "MappedTree":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return (f"MappedTree(path={self.path!r}, root={self.root}, height={self.height}, "
+                f"rule_id={self.rule_id}, typecode='{self.typecode}')")
+
+
+# ---------------- Потоковый экспорт: zigzag-varint ----------------
+# Поток: заголовок VARINT_MAGIC + байт флагов, дальше записи по кускам уровней:
+#   varint level, varint start, varint count, затем count значений.
+# Значение (или разность с предыдущим в куске, если стоит флаг delta)
+# кодируется zigzag (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...) и затем varint:
+# по 7 бит в байте, старший бит — "дальше ещё байт". Big int тоже подходят.
+VARINT_MAGIC = b"BTVAR\x00\x00\x01"
+_FLAG_DELTA = 1
+
+
+def zigzag(n: int) -> int:
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def unzigzag(z: int) -> int:
+    return z >> 1 if not z & 1 else -((z + 1) >> 1)
+
+
+def _put_varint(out: bytearray, n: int) -> None:
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def encode_chunk(level: int, start: int, values: List[int], delta: bool) -> bytes:
+    """Одна запись потока: заголовок куска и сами значения."""
+    out = bytearray()
+    _put_varint(out, level)
+    _put_varint(out, start)
+    _put_varint(out, len(values))
+    prev = 0
+    for v in values:
+        _put_varint(out, zigzag(v - prev if delta else v))
+        if delta:
+            prev = v
+    return bytes(out)
+
+
+def write_levels_varint(
+    stream: BinaryIO,
+    chunks: Iterable[Tuple[int, int, List[int]]],
+    delta: bool = False,
+) -> int:
+    """
+    Пишу куски (level, start, values) в поток по одному — в памяти только текущий кусок.
+    Подходит прямо вывод iter_level_chunks. Возвращает число записанных байт.
+    """
+    written = stream.write(VARINT_MAGIC + bytes([_FLAG_DELTA if delta else 0]))
+    for level, start, values in chunks:
+        written += stream.write(encode_chunk(level, start, values, delta))
+    return written
+
+
+def export_tree_varint(
+    path: str,
+    data: Dict[str, Any],
+    left_fn: Callable[[int], int],
+    right_fn: Callable[[int], int],
+    delta: bool = False,
+    chunk_size: int = 65536,
+) -> int:
+    """Строю дерево по кускам и сразу пишу в файл (см. write_levels_varint)."""
+    with open(path, "wb") as f:
+        return write_levels_varint(f, iter_level_chunks(data, left_fn, right_fn, chunk_size), delta)
+
+
+class _VarintReader:
+    """Читаю varint из потока блоками, чтобы не дёргать read() на каждый байт."""
+
+    def __init__(self, stream: BinaryIO, block_size: int = 1 << 16) -> None:
+        self._stream = stream
+        self._block_size = block_size
+        self._buf = b""
+        self._pos = 0
+
+    def at_eof(self) -> bool:
+        if self._pos < len(self._buf):
+            return False
+        self._buf = self._stream.read(self._block_size)
+        self._pos = 0
+        return not self._buf
+
+    def read_varint(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            if self.at_eof():
+                raise ValueError("поток оборвался посреди числа")
+            byte = self._buf[self._pos]
+            self._pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+
+def iter_varint_chunks(stream: BinaryIO) -> Iterator[Tuple[int, int, List[int]]]:
+    """
+    Инкрементальное чтение: отдаю (level, start, values) по одному куску,
+    в том же порядке, в каком они были записаны.
+    """
+    header = stream.read(len(VARINT_MAGIC) + 1)
+    if len(header) != len(VARINT_MAGIC) + 1 or header[:-1] != VARINT_MAGIC:
+        raise ValueError("это не поток варинтов дерева")
+    delta = bool(header[-1] & _FLAG_DELTA)
+
+    reader = _VarintReader(stream)
+    while not reader.at_eof():
+        level = reader.read_varint()
+        start = reader.read_varint()
+        count = reader.read_varint()
+        values: List[int] = []
+        prev = 0
+        for _ in range(count):
+            v = unzigzag(reader.read_varint())
+            if delta:
+                v += prev
+                prev = v
+            values.append(v)
+        yield level, start, values
+
+
+def read_levels_varint(path: str) -> List[List[int]]:
+    """Читаю весь файл обратно в список уровней (для проверки и маленьких деревьев)."""
+    levels: List[List[int]] = []
+    with open(path, "rb") as f:
+        for level, _, values in iter_varint_chunks(f):
+            if level == len(levels):
+                levels.append([])
+            levels[level].extend(values)
+    return levels
+
+
+def compare_export_formats(root: int, height: int, directory: str) -> List[Dict[str, Any]]:
+    """
+    Сравниваю экспорт дерева: текст (как pretty_print_levels), pickle и varint
+    (с delta и без). Для каждого — размер файла, время записи и чтения.
+    """
+    import pickle
+    import time
+    from binary_tree_step3 import build_tree_iterative, left_child_variant_14, right_child_variant_14
+
+    data = {"root": root, "height": height}
+    levels = build_tree_iterative(data, left_child_variant_14, right_child_variant_14)
+
+    def write_text(path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for i, level in enumerate(levels, start=1):
+                f.write(f"Уровень {i}: {level}\n")
+
+    def read_text(path: str) -> None:
+        with open(path, encoding="utf-8") as f:
+            [[int(x) for x in line.split(": ", 1)[1].strip("[]\n").split(", ")] for line in f]
+
+    def write_pickle(path: str) -> None:
+        with open(path, "wb") as f:
+            pickle.dump(levels, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def read_pickle(path: str) -> None:
+        with open(path, "rb") as f:
+            pickle.load(f)
+
+    formats = [
+        ("text", write_text, read_text),
+        ("pickle", write_pickle, read_pickle),
+        ("varint", lambda path: export_tree_varint(
+            path, data, left_child_variant_14, right_child_variant_14), read_levels_varint),
+        ("varint_delta", lambda path: export_tree_varint(
+            path, data, left_child_variant_14, right_child_variant_14, delta=True), read_levels_varint),
+    ]
+    rows: List[Dict[str, Any]] = []
+    for name, write, read in formats:
+        path = os.path.join(directory, f"tree.{name}")
+        start = time.perf_counter()
+        write(path)
+        write_s = time.perf_counter() - start
+        start = time.perf_counter()
+        read(path)
+        read_s = time.perf_counter() - start
+        rows.append({"format": name, "bytes": os.path.getsize(path),
+                     "write_s": write_s, "read_s": read_s})
+    return rows
+
+
+if __name__ == "__main__":
+    # Маленькая проверка: пишу дерево варианта №14, открываю и сравниваю.
+    from binary_tree_step3 import build_tree_iterative, left_child_variant_14, right_child_variant_14
+
+    demo = {"root": 14, "height": 12}
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "tree14.bt")
+        size = write_tree_file(file_path, demo, left_child_variant_14, right_child_variant_14)
+        with MappedTree(file_path) as tree:
+            same = tree == build_tree_iterative(demo, left_child_variant_14, right_child_variant_14)
+            print(tree, f"{size} байт")
+            print("Совпадает с build_tree_iterative? ->", "Да" if same else "Нет")
+
+        # Экспорт в varint против текста и pickle.
+        print("\n{:<14} {:>12} {:>10} {:>10}".format("format", "bytes", "write_s", "read_s"))
+        for row in compare_export_formats(14, 18, tmp):
+            print("{:<14} {:>12} {:>10.4f} {:>10.4f}".format(
+                row["format"], row["bytes"], row["write_s"], row["read_s"]))